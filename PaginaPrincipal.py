@@ -6,9 +6,13 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import pytz
-from kommo_api import get_api_data
-from data_processor import procesar_datos
+from data_processor import dia_clave, fecha_de_clave, SIN_FECHA
 from config import CONFIG
+from lead_index import obtener_indice
+from lead_rollup import CuboLeads, obtener_cubo
+from lead_tags import obtener_indice_tags
+from lead_search import obtener_indice_busqueda
+from lead_refresher import obtener_refrescador, mostrar_estado
 
 # --- Configuración de la Página ---
 st.set_page_config(
@@ -18,11 +22,15 @@ st.set_page_config(
 )
 
 # --- Constante de Zona Horaria ---
-LOCAL_TIMEZONE = pytz.timezone('America/Mexico_City')
+LOCAL_TIMEZONE = pytz.timezone(CONFIG['zona_horaria'])
 
 # --- Funciones Auxiliares ---
-@st.cache_data(ttl=3600)
-def cargar_y_procesar_datos():
+def cargar_y_procesar_datos(actualizar=False):
+    """
+    Último DataFrame bueno del refrescador en segundo plano. Solo espera a la
+    API si todavía no hay ningún conjunto de datos (primer arranque sin caché en disco).
+    Con 'actualizar' se pide una descarga nueva sin dejar de devolver los datos actuales.
+    """
     try:
         subdomain = st.secrets["KOMMO_SUBDOMAIN"]
         access_token = st.secrets["KOMMO_ACCESS_TOKEN"]
@@ -32,13 +40,21 @@ def cargar_y_procesar_datos():
     except KeyError as e:
         st.error(f"Error: La credencial '{e}' no se encontró en 'secrets.toml'.")
         return None
-    with st.spinner('Obteniendo y procesando datos desde Kommo...'):
-        api_data = get_api_data(base_url=f"https://{subdomain}.kommo.com/api/v4", headers={'Authorization': f"Bearer {access_token}"})
-        if not api_data or not api_data.get('leads'):
-            st.warning("No se obtuvieron datos de leads desde la API.")
-            return pd.DataFrame()
-        df = procesar_datos(api_data)
-    return df
+    refrescador = obtener_refrescador(subdomain, access_token)
+    if actualizar:
+        refrescador.solicitar_actualizacion()
+    if refrescador.df is None:
+        with st.spinner('Obteniendo y procesando datos desde Kommo...'):
+            progreso = st.empty()
+            while not refrescador.esperar_primera_carga(timeout=0.5):
+                if refrescador.leads_recibidos:
+                    progreso.caption(f"{refrescador.leads_recibidos:,} leads recibidos...")
+            progreso.empty()
+    mostrar_estado(refrescador)
+    if refrescador.df is None:
+        st.warning(refrescador.error or "No se obtuvieron datos de leads desde la API.")
+        return pd.DataFrame()
+    return refrescador.df
 
 def get_date_range(period, min_date, max_date):
     today = datetime.now(LOCAL_TIMEZONE).date()
@@ -58,13 +74,10 @@ def get_date_range(period, min_date, max_date):
     if period == "Manual": return None, None
     return start_date, end_date
 
-def create_sparkline(data, date_col, metric_col):
-    data_cleaned = data.dropna(subset=[date_col])
-    if data_cleaned.empty:
+def create_sparkline(daily_data):
+    if daily_data.empty:
         fig = go.Figure()
     else:
-        data_cleaned[date_col] = data_cleaned[date_col].dt.tz_convert(LOCAL_TIMEZONE)
-        daily_data = data_cleaned.set_index(date_col).resample('D')[metric_col].sum()
         fig = go.Figure(go.Scatter(
             x=daily_data.index, y=daily_data, mode='lines',
             line=dict(color=CONFIG['colores']['principal'], width=2),
@@ -81,25 +94,26 @@ def create_sparkline(data, date_col, metric_col):
 st.title("📈 Dashboard de Ventas y Operaciones")
 st.markdown("### Grúas Móviles del Golfo")
 st.sidebar.title("Acciones")
-if st.sidebar.button("Recargar Datos 🔄"):
-    st.cache_data.clear()
-    st.success("Cache limpiado. Recargando los datos...")
-    st.rerun()
+recargar = st.sidebar.button("Recargar Datos 🔄")
 
 # --- Carga de Datos ---
-df_master = cargar_y_procesar_datos()
+df_master = cargar_y_procesar_datos(actualizar=recargar)
 
 if df_master is None or df_master.empty:
     st.warning("No se pudieron cargar los datos o no hay leads disponibles.")
     st.stop()
 
+if recargar:
+    # La descarga sigue en segundo plano; mientras tanto se muestran los datos actuales
+    st.sidebar.success("Actualización solicitada. Los datos nuevos aparecerán al terminar.")
+
 # --- SECCIÓN: MONITOR DEL DÍA ---
 st.header(f"Monitor del Día - {datetime.now(LOCAL_TIMEZONE).strftime('%A, %d de %B de %Y')}")
 
 with st.container(border=True):
-    today_date = datetime.now(LOCAL_TIMEZONE).date()
-    df_today_created = df_master[df_master['created_at'].dt.tz_convert(LOCAL_TIMEZONE).dt.date == today_date]
-    df_today_updated = df_master[df_master['updated_at'].dt.tz_convert(LOCAL_TIMEZONE).dt.date == today_date]
+    today_key = dia_clave(datetime.now(LOCAL_TIMEZONE).date())
+    df_today_created = df_master[df_master['dia_creado'] == today_key]
+    df_today_updated = df_master[df_master['dia_actualizado'] == today_key]
 
     leads_creados_hoy = len(df_today_created)
     ganados_hoy_df = df_today_updated[df_today_updated['estado'] == 'Ganado']
@@ -125,7 +139,7 @@ with st.container(border=True):
     with st.container(border=True):
         st.markdown("#### 📊 Rendimiento de Ejecutivos (Hoy)")
         if not df_today_created.empty:
-            rendimiento_hoy = df_today_created.groupby('responsable_nombre')['id'].count().reset_index()
+            rendimiento_hoy = df_today_created.groupby('responsable_nombre', observed=True)['id'].count().reset_index()
             rendimiento_hoy.columns = ['Ejecutivo', 'Leads Creados Hoy']
             fig_rendimiento = px.bar(rendimiento_hoy, x='Leads Creados Hoy', y='Ejecutivo', orientation='h', text_auto=True)
             fig_rendimiento.update_layout(showlegend=False, yaxis={'categoryorder':'total ascending'}, height=250)
@@ -135,11 +149,11 @@ with st.container(border=True):
     st.markdown("<br>", unsafe_allow_html=True)
     with st.container(border=True):
         st.markdown("#### ⚡ Actividad Reciente del Día")
-        df_master['fecha_evento'] = df_master['updated_at'].dt.tz_convert(LOCAL_TIMEZONE)
-        df_eventos_hoy = df_master[df_master['fecha_evento'].dt.date == today_date].copy()
-        df_eventos_hoy['evento'] = "Actualizado: " + df_eventos_hoy['estado']
-        df_eventos_hoy.loc[df_eventos_hoy['created_at'].dt.tz_convert(LOCAL_TIMEZONE).dt.date == today_date, 'evento'] = 'Creado'
-        df_eventos_hoy.loc[df_eventos_hoy['closed_at'].dt.tz_convert(LOCAL_TIMEZONE).dt.date == today_date, 'evento'] = 'Cerrado: ' + df_eventos_hoy['estado']
+        df_eventos_hoy = df_today_updated.copy()
+        df_eventos_hoy['fecha_evento'] = df_eventos_hoy['updated_at_local']
+        df_eventos_hoy['evento'] = "Actualizado: " + df_eventos_hoy['estado'].astype(str)
+        df_eventos_hoy.loc[df_eventos_hoy['dia_creado'] == today_key, 'evento'] = 'Creado'
+        df_eventos_hoy.loc[df_eventos_hoy['dia_cerrado'] == today_key, 'evento'] = 'Cerrado: ' + df_eventos_hoy['estado'].astype(str)
         df_eventos_hoy['etiquetas'] = df_eventos_hoy['tags'].apply(lambda x: ', '.join(x) if isinstance(x, list) and x else 'N/A')
         df_eventos_hoy = df_eventos_hoy.sort_values('fecha_evento', ascending=False)
         st.dataframe(
@@ -158,8 +172,9 @@ st.header("Análisis Histórico y Búsqueda")
 
 col1, col2, col3, col4 = st.columns([2, 2, 1.5, 1.5])
 with col1:
-    min_date_hist = df_master['created_at'].dt.date.min()
-    max_date_hist = df_master['created_at'].dt.date.max()
+    dias_creados = df_master['dia_creado'][df_master['dia_creado'] != SIN_FECHA]
+    min_date_hist = fecha_de_clave(dias_creados.min())
+    max_date_hist = fecha_de_clave(dias_creados.max())
     date_options = ["Manual", "Ayer", "Últimos 7 días", "Últimos 30 días", "Esta semana", "Este mes", "Mes pasado", "Todo el tiempo"]
     selected_period = st.selectbox("Selecciona un periodo", options=date_options, index=2)
     is_manual = selected_period == "Manual"
@@ -180,47 +195,51 @@ with col3:
     estados = sorted(df_master['estado'].unique())
     selected_statuses = st.multiselect("Estado del Lead", options=estados, default=estados)
 with col4:
-    search_query = st.text_input("Buscar por Nombre/Folio", placeholder="Escribe para buscar...")
+    search_query = st.text_input("Buscar por Nombre/Folio", placeholder="Nombre, contacto o folio...")
 
 if not selected_executives or not selected_statuses:
     st.warning("Por favor, selecciona al menos un ejecutivo y un estado para el análisis histórico.")
     st.stop()
 
-# --- CORRECCIÓN DEL TypeError ---
-# Comparamos la parte de la fecha (.dt.date) de la columna con las fechas seleccionadas
-df_filtered = df_master[
-    (df_master['created_at'].dt.tz_convert(LOCAL_TIMEZONE).dt.date >= selected_start) & 
-    (df_master['created_at'].dt.tz_convert(LOCAL_TIMEZONE).dt.date <= selected_end) &
-    (df_master['responsable_nombre'].isin(selected_executives)) & 
-    (df_master['estado'].isin(selected_statuses))
-]
+# Rango de fechas por búsqueda binaria sobre el día local de creación, luego ejecutivos y estados
+df_filtered = df_master.iloc[obtener_indice(df_master).filtrar(selected_start, selected_end, selected_executives, selected_statuses)]
 if search_query:
-    df_filtered = df_filtered[df_filtered['name'].str.contains(search_query, case=False, na=False)]
+    indice_busqueda = obtener_indice_busqueda(df_master)
+    # Un folio exacto se muestra aunque quede fuera de los filtros del periodo
+    posicion_folio = indice_busqueda.posicion_folio(search_query)
+    if posicion_folio is not None:
+        lead = df_master.iloc[posicion_folio]
+        st.info(f"**Folio {lead['id']}:** {lead['name']} · {lead['contacto_nombre']} · {lead['responsable_nombre']} · "
+                f"{lead['estado']} ({lead['etapa_nombre']}) · ${lead['price']:,.0f} · creado el {lead['created_at_local']:%Y-%m-%d}")
+    df_filtered = df_filtered[df_filtered['id'].isin(indice_busqueda.buscar(search_query))]
 
 if df_filtered.empty:
     st.warning("No hay datos para los filtros seleccionados en el análisis histórico.")
     st.stop()
 
+# KPIs, sparklines y gráficos se calculan sobre el cubo preagregado; la búsqueda por
+# texto no es una dimensión del cubo, así que en ese caso se agrega solo lo filtrado
+if search_query:
+    cubo_periodo = CuboLeads.desde_leads(df_filtered)
+else:
+    cubo_periodo = obtener_cubo(df_master).filtrar(selected_start, selected_end, selected_executives, selected_statuses)
+kpis_periodo = cubo_periodo.kpis()
+
 st.markdown("---")
 st.header("Indicadores Clave del Periodo Seleccionado")
 kpi_cols = st.columns(5)
-total_leads = len(df_filtered)
-ventas_ganadas_df = df_filtered[df_filtered['estado'] == 'Ganado']
-total_ventas_ganadas = len(ventas_ganadas_df)
-tasa_conversion = (total_ventas_ganadas / total_leads * 100) if total_leads > 0 else 0
-ciclo_venta_promedio = ventas_ganadas_df.dropna(subset=['dias_para_cerrar'])['dias_para_cerrar'].mean()
-valor_total_ganado = ventas_ganadas_df['price'].sum()
+total_leads = kpis_periodo['total_leads']
+total_ventas_ganadas = kpis_periodo['ventas_ganadas']
+tasa_conversion = kpis_periodo['tasa_conversion']
+ciclo_venta_promedio = kpis_periodo['ciclo_promedio']
+valor_total_ganado = kpis_periodo['valor_ganado']
 
-df_filtered_copy = df_filtered.copy()
-df_filtered_copy['leads_count'] = 1
-spark_leads = create_sparkline(df_filtered_copy, 'created_at', 'leads_count')
+spark_leads = create_sparkline(cubo_periodo.serie_diaria('leads'))
 with kpi_cols[0]:
     st.metric(label="Leads Generados", value=f"{total_leads}")
     st.plotly_chart(spark_leads, use_container_width=True, key="spark_leads_hist")
 
-ventas_ganadas_df_copy = ventas_ganadas_df.copy()
-ventas_ganadas_df_copy['ventas_count'] = 1
-spark_ventas = create_sparkline(ventas_ganadas_df_copy, 'closed_at', 'ventas_count')
+spark_ventas = create_sparkline(cubo_periodo.serie_ganados_por_cierre())
 with kpi_cols[1]:
     st.metric(label="Ventas Ganadas", value=f"{total_ventas_ganadas}")
     st.plotly_chart(spark_ventas, use_container_width=True, key="spark_ventas_hist")
@@ -239,13 +258,13 @@ color_map = {
     'Perdido': colores_config.get('perdido', '#dc3545')
 }
 with viz_col1:
-    funnel_data = df_filtered.groupby(['responsable_nombre', 'estado']).size().reset_index(name='counts')
+    funnel_data = cubo_periodo.conteos(['responsable_nombre', 'estado']).reset_index(name='counts')
     fig_funnel = px.bar(funnel_data, x='counts', y='responsable_nombre', color='estado', orientation='h', title='Funnel de Conversión por Ejecutivo', labels={'counts': 'Cantidad de Leads', 'responsable_nombre': 'Ejecutivo'}, color_discrete_map=color_map)
     fig_funnel.update_layout(yaxis={'categoryorder':'total ascending'})
     st.plotly_chart(fig_funnel, use_container_width=True, key="funnel_chart_hist")
 with viz_col2:
     health_colors = {'Saludable': '#28a745', 'En Riesgo': '#ffc107', 'Crítico': '#dc3545'}
-    health_counts = df_filtered[df_filtered['salud_lead'] != 'N/A']['salud_lead'].value_counts().reset_index()
+    health_counts = cubo_periodo.conteos_salud().sort_values(ascending=False).reset_index()
     health_counts.columns = ['salud_lead', 'counts']
     fig_health = px.pie(health_counts, values='counts', names='salud_lead', title='Salud de la Cartera de Leads Activos', hole=0.4, color='salud_lead', color_discrete_map=health_colors)
     st.plotly_chart(fig_health, use_container_width=True, key="health_chart_hist")
@@ -259,6 +278,7 @@ with tab1:
                    column_config={"dias_sin_actualizar": st.column_config.ProgressColumn("Días sin Actualizar", help="Días desde la última actualización", format="%f días", min_value=0, max_value=int(leads_criticos['dias_sin_actualizar'].max()) if not leads_criticos.empty else 100)},
                    hide_index=True, use_container_width=True)
 with tab2:
+    ventas_ganadas_df = df_filtered[df_filtered['estado'] == 'Ganado']
     st.data_editor(ventas_ganadas_df[['name', 'responsable_nombre', 'estado', 'price', 'closed_at', 'dias_para_cerrar']],
                    column_config={"price": st.column_config.NumberColumn("Valor", format="$ %d")},
                    hide_index=True, use_container_width=True)
@@ -274,7 +294,7 @@ else:
     
     with col_loss1:
         # Gráfica de barras de principales motivos
-        loss_reason_counts = df_perdidos['motivo_perdida_nombre'].value_counts().reset_index()
+        loss_reason_counts = df_perdidos['motivo_perdida_nombre'].value_counts().loc[lambda s: s > 0].reset_index()
         loss_reason_counts.columns = ['motivo', 'cantidad']
         fig_loss = px.bar(
             loss_reason_counts, 
@@ -290,21 +310,8 @@ else:
         st.plotly_chart(fig_loss, use_container_width=True)
     
     with col_loss2:
-        # Clasificar motivos en Operativos vs Factores Externos
-        motivos_operativos = ['Unidad ocupada', 'Unidad sin operador', 'Unidad fuera de servicio', 'Sin unidades disponibles']
-        
-        df_perdidos_copy = df_perdidos.copy()
-        def clasificar_impacto(motivo):
-            if pd.isna(motivo):
-                return 'Factores del Cliente\n/ Mercado'
-            motivo_lower = motivo.lower()
-            for m in motivos_operativos:
-                if m.lower() in motivo_lower:
-                    return 'Capacidad Operativa\n(Flota/Personal)'
-            return 'Factores del Cliente\n/ Mercado'
-        
-        df_perdidos_copy['impacto'] = df_perdidos_copy['motivo_perdida_nombre'].apply(clasificar_impacto)
-        impacto_counts = df_perdidos_copy['impacto'].value_counts().reset_index()
+        # Operativos vs Factores Externos: 'impacto_perdida' viene clasificado desde procesar_datos
+        impacto_counts = df_perdidos['impacto_perdida'].value_counts().loc[lambda s: s > 0].reset_index()
         impacto_counts.columns = ['impacto', 'cantidad']
         
         fig_impacto = px.pie(
@@ -314,8 +321,8 @@ else:
             title='Clasificación de Pérdidas',
             color='impacto',
             color_discrete_map={
-                'Capacidad Operativa\n(Flota/Personal)': '#ff9999',
-                'Factores del Cliente\n/ Mercado': '#66b3ff'
+                CONFIG['motivos_perdida']['impacto_operativo']: '#ff9999',
+                CONFIG['motivos_perdida']['impacto_externo']: '#66b3ff'
             }
         )
         fig_impacto.update_traces(textposition='inside', textinfo='percent+label', textfont_size=11)
@@ -329,10 +336,9 @@ else:
     df_ocupada = df_perdidos[df_perdidos['motivo_perdida_nombre'].str.contains('ocupada', case=False, na=False)]
     
     if not df_ocupada.empty:
-        # Explotar tags para contar qué unidades se solicitaron más
-        tags_ocupada = df_ocupada.explode('tags')['tags'].value_counts().reset_index()
+        # Contar qué unidades (tags) se solicitaron más, sobre el índice de etiquetas
+        tags_ocupada = obtener_indice_tags(df_master).conteos(df_ocupada['id']).head(10).reset_index()
         tags_ocupada.columns = ['unidad', 'cantidad']
-        tags_ocupada = tags_ocupada[tags_ocupada['unidad'].notna()].head(10)
         
         if not tags_ocupada.empty:
             fig_criticas = px.bar(
@@ -360,26 +366,12 @@ else:
     # --- FILA 3: Mapa de Calor - Motivos por Vendedor ---
     st.markdown("#### Mapa de Calor: Motivos de Pérdida por Vendedor")
     
-    # Crear tabla pivote para el mapa de calor
-    df_heatmap = df_perdidos.copy()
-    df_heatmap['motivo_corto'] = df_heatmap['motivo_perdida_nombre'].apply(lambda x: 
-        'Unidad ocupada' if pd.notna(x) and 'ocupada' in x.lower() else
-        'Sin respuesta' if pd.notna(x) and 'respuesta' in x.lower() else
-        'Cuadro comparativo' if pd.notna(x) and 'comparativo' in x.lower() else
-        'Descuento' if pd.notna(x) and 'descuento' in x.lower() else
-        'Fuera de servicio' if pd.notna(x) and 'fuera' in x.lower() else
-        'Sin operador' if pd.notna(x) and 'operador' in x.lower() else
-        'Baja demanda' if pd.notna(x) and 'demanda' in x.lower() else
-        'No especificado' if pd.isna(x) or x == '' else
-        x[:15] if len(str(x)) > 15 else x
-    )
-    
-    # Acortar nombres de vendedores
-    df_heatmap['vendedor_corto'] = df_heatmap['responsable_nombre'].apply(lambda x: 
-        ' '.join(str(x).split()[:2]) if pd.notna(x) else 'Sin asignar'
+    # Tabla pivote del mapa de calor: conteo por códigos de 'motivo_corto' (de procesar_datos)
+    # y del vendedor; el nombre corto del vendedor se calcula una vez por categoría
+    vendedor_corto = df_perdidos['responsable_nombre'].map(
+        lambda x: ' '.join(str(x).split()[:2]) if pd.notna(x) else 'Sin asignar'
     )
-    
-    pivot_table = pd.crosstab(df_heatmap['motivo_corto'], df_heatmap['vendedor_corto'])
+    pivot_table = df_perdidos.groupby([df_perdidos['motivo_corto'], vendedor_corto.rename('vendedor_corto')], observed=True).size().unstack(fill_value=0)
     
     if not pivot_table.empty and pivot_table.shape[0] > 1 and pivot_table.shape[1] > 1:
         fig_heatmap = px.imshow(
@@ -415,9 +407,8 @@ else:
                 st.write("No se perdieron leads por este motivo en el periodo seleccionado.")
                 return None
             else:
-                tags_count = df_reason.explode('tags')['tags'].value_counts().reset_index()
+                tags_count = obtener_indice_tags(df_master).conteos(df_reason['id']).reset_index()
                 tags_count.columns = ['Unidad (Etiqueta)', column_title]
-                tags_count = tags_count[tags_count['Unidad (Etiqueta)'].notna()]
                 st.dataframe(tags_count, use_container_width=True, hide_index=True)
                 return tags_count
 
@@ -443,4 +434,3 @@ else:
         
         st.markdown("**Detalle completo de motivos:**")
         st.dataframe(loss_reason_counts, use_container_width=True, hide_index=True)
-
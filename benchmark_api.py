@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# BENCHMARK DE DESCARGA DE PÁGINAS
+# =============================================================================
+# Levanta un servidor local que imita la paginación de Kommo (con latencia
+# simulada) y compara la descarga secuencial contra la concurrente de
+# KommoAPI.get_all_pages.
+#
+# Uso: python benchmark_api.py [total_leads] [latencia_ms]
+# =============================================================================
+
+import json
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from kommo_api import KommoAPI
+
+def crear_servidor_mock(total_leads, latencia):
+    leads = [{'id': i, 'name': f"Lead {i}", 'updated_at': 1700000000 + i} for i in range(1, total_leads + 1)]
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latencia)
+            url = urllib.parse.urlparse(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            page, limit = int(query.get('page', 1)), int(query.get('limit', 50))
+            chunk = leads[(page - 1) * limit: page * limit]
+            if not chunk:
+                self.send_response(204)
+                self.end_headers()
+                return
+            body = {'_page': page, '_embedded': {'leads': chunk}, '_links': {}}
+            if page * limit < len(leads):
+                query.update({'page': page + 1, 'limit': limit})
+                body['_links']['next'] = {'href': f"http://{self.headers['Host']}{url.path}?{urllib.parse.urlencode(query)}"}
+            raw = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/hal+json')
+            self.send_header('Content-Length', str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def medir(api, parallel):
+    inicio = time.perf_counter()
+    # El modo secuencial también pide 250 por página para comparar el mismo número de peticiones
+    leads = api.get_all_pages('leads', params={'limit': 250}, parallel=parallel)
+    return time.perf_counter() - inicio, leads
+
+def main():
+    total_leads = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    latencia = (int(sys.argv[2]) if len(sys.argv) > 2 else 300) / 1000
+    server = crear_servidor_mock(total_leads, latencia)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/api/v4"
+
+    print(f"=== BENCHMARK: {total_leads} leads, latencia simulada {latencia * 1000:.0f} ms ===")
+    t_seq, leads_seq = medir(KommoAPI(base_url, {}), parallel=False)
+    print(f"Secuencial: {t_seq:.2f} s ({len(leads_seq)} leads)")
+    api_par = KommoAPI(base_url, {})
+    t_par, leads_par = medir(api_par, parallel=True)
+    print(f"Concurrente: {t_par:.2f} s ({len(leads_par)} leads)")
+
+    mismo_orden = [l['id'] for l in leads_seq] == [l['id'] for l in leads_par]
+    print(f"Mismo orden de leads: {'sí' if mismo_orden else 'NO'}")
+    print(f"Aceleración: {t_seq / t_par:.1f}x")
+    print(f"Latencias (modo concurrente): {api_par.get_latency_stats()}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
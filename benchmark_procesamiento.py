@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# BENCHMARK DE PROCESAMIENTO DE LEADS
+# =============================================================================
+# Compara procesar_datos contra la versión anterior basada en apply por fila,
+# sobre leads sintéticos ya normalizados (como los entrega kommo_api).
+#
+# Uso: python benchmark_procesamiento.py [tamaño ...]   (por defecto 10k 100k 1M)
+# =============================================================================
+
+import sys
+import time
+import warnings
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytz
+
+from config import CONFIG
+from data_processor import normalizar_texto, procesar_datos
+
+def generar_datos(n, seed=0):
+    rng = np.random.default_rng(seed)
+    users = [{'id': 100 + i, 'name': f"Ejecutivo {i}"} for i in range(12)]
+    loss_reasons = [{'id': 500 + i, 'name': f"Motivo {i}"} for i in range(9)]
+    pipelines, status_ids = [], [142, 143]
+    # Kommo repite 142/143 en cada pipeline; el excluido va primero para que esos ids
+    # queden asociados a un pipeline que se conserva (como con los datos reales)
+    for pid, nombre in enumerate([CONFIG['pipeline_a_excluir'], 'Ventas', 'Renta'], start=1):
+        statuses = [{'id': pid * 100 + j, 'name': f"ETAPA {j} del pipeline"} for j in range(5)]
+        statuses.append({'id': pid * 100 + 5, 'name': 'PROCESO DE COBRO'})
+        statuses += [{'id': 142, 'name': 'Venta ganada'}, {'id': 143, 'name': 'Venta perdida'}]
+        status_ids += [s['id'] for s in statuses[:6]]
+        pipelines.append({'id': pid, 'name': nombre, '_embedded': {'statuses': statuses}})
+    tags = ['Grúa 30T', 'Grúa 90T', 'Plataforma', 'Urgente', 'Recurrente']
+
+    now = int(time.time())
+    created = now - rng.integers(0, 3 * 365 * 86400, n)
+    updated = np.minimum(now, created + rng.integers(0, 90 * 86400, n))
+    status = rng.choice(status_ids, n)
+    closed = np.where(np.isin(status, [142, 143]), updated, np.nan)
+    leads = pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'name': [f"Lead {i}" for i in range(n)],
+        'price': rng.choice([0, 3000, 8000, 25000], n),
+        'responsible_user_id': rng.choice([u['id'] for u in users] + [999], n),
+        'status_id': status,
+        'loss_reason_id': np.where(status == 143, rng.choice([r['id'] for r in loss_reasons], n), np.nan),
+        'created_at': created,
+        'updated_at': updated,
+        'closed_at': closed,
+    })
+    n_tags = rng.integers(0, 3, n)
+    leads['tags'] = [list(rng.choice(tags, k, replace=False)) for k in n_tags]
+    return {'leads': leads, 'users': users, 'loss_reasons': loss_reasons, 'pipelines': pipelines}
+
+def procesar_datos_original(api_data):
+    """Implementación anterior (apply por fila), conservada como referencia del benchmark."""
+    # La versión original construía su propio DataFrame a partir de la lista de leads
+    df = api_data['leads'].copy()
+    user_map = {user['id']: user['name'] for user in api_data['users']}
+    loss_reason_map = {reason['id']: reason['name'] for reason in api_data['loss_reasons']}
+    pipeline_map, status_map = {}, {}
+    for p in api_data['pipelines']:
+        pipeline_map[p['id']] = p['name']
+        for s in p['_embedded']['statuses']: status_map[s['id']] = {'name': s['name'], 'pipeline_id': p['id']}
+
+    df['responsable_nombre'] = df['responsible_user_id'].map(user_map).fillna('No asignado')
+    df['etapa_nombre'] = df['status_id'].apply(lambda x: status_map.get(x, {}).get('name', 'Etapa Desconocida')).apply(normalizar_texto)
+    df['pipeline_nombre'] = df['status_id'].apply(lambda x: status_map.get(x, {}).get('pipeline_id')).map(pipeline_map)
+    df['motivo_perdida_nombre'] = df['loss_reason_id'].map(loss_reason_map).fillna('No especificado')
+    for col in ['created_at', 'updated_at', 'closed_at']:
+        df[col] = pd.to_datetime(df[col], unit='s', errors='coerce').dt.tz_localize('UTC')
+    df = df[df['pipeline_nombre'] != CONFIG['pipeline_a_excluir']]
+    condiciones = [(df['etapa_nombre'] == 'Proceso De Cobro') | (df['status_id'] == 142), df['status_id'] == 143]
+    df['estado'] = np.select(condiciones, ['Ganado', 'Perdido'], default='En Trámite')
+    df['dias_para_cerrar'] = (df['closed_at'] - df['created_at']).dt.days
+    df['dias_sin_actualizar'] = (datetime.now(pytz.utc) - df['updated_at']).dt.days
+
+    def get_lead_health(row):
+        if row['estado'] != 'En Trámite': return 'N/A'
+        if row['dias_sin_actualizar'] >= CONFIG['dias_lead_critico']: return 'Crítico'
+        if row['dias_sin_actualizar'] >= CONFIG['dias_lead_en_riesgo']: return 'En Riesgo'
+        return 'Saludable'
+
+    df['salud_lead'] = df.apply(get_lead_health, axis=1)
+    return df
+
+def medir(funcion, api_data):
+    inicio = time.perf_counter()
+    resultado = funcion(api_data)
+    return time.perf_counter() - inicio, resultado
+
+def main():
+    # La versión original asigna columnas sobre un slice; sus avisos no aportan al benchmark
+    warnings.simplefilter('ignore', pd.errors.SettingWithCopyWarning)
+    tamanos = [int(float(x)) for x in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    print("=== BENCHMARK: procesar_datos ===")
+    print(f"{'Leads':>10} {'Antes (s)':>10} {'Después (s)':>12} {'Mejora':>8}")
+    for n in tamanos:
+        api_data = generar_datos(n)
+        t_antes, df_antes = medir(procesar_datos_original, api_data)
+        t_despues, df_despues = medir(procesar_datos, api_data)
+        columnas = ['responsable_nombre', 'etapa_nombre', 'pipeline_nombre', 'motivo_perdida_nombre', 'estado', 'salud_lead', 'tags']
+        iguales = df_antes[columnas].astype(str).reset_index(drop=True).equals(df_despues[columnas].astype(str).reset_index(drop=True))
+        print(f"{n:>10,} {t_antes:>10.2f} {t_despues:>12.2f} {t_antes / t_despues:>7.1f}x{'' if iguales else '  (¡resultados distintos!)'}")
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,70 @@
 
 CONFIG = {
     'pipeline_a_excluir': "whatsapp",
+    'zona_horaria': 'America/Mexico_City',
     'cache_duration_hours': 4,
     'dias_lead_en_riesgo': 15,
     'dias_lead_critico': 30,
+    'api': {
+        'paginacion_paralela': True,
+        'max_workers': 4,
+        'requests_por_segundo': 7,  # Límite documentado por Kommo por cuenta
+        'limite_por_pagina': 250,
+        'pool_conexiones': 10,
+        'timeout_conexion': 5,  # segundos
+        'timeout_lectura': 60,  # segundos
+        'reintentos_maximos': 5,  # por petición
+        'presupuesto_reintentos': 30,  # reintentos totales por endpoint
+        'reanudaciones_maximas': 2,  # veces que se reanuda una paginación interrumpida
+        'backoff_base': 0.5,  # segundos
+        'backoff_maximo': 30,  # segundos
+        # Si un 429 pide esperar más (Retry-After), la descarga se corta y se reanuda en el siguiente ciclo
+        'espera_maxima_retry_after': 120,  # segundos
+    },
+    'sync': {
+        'incremental': True,
+        'snapshot_path': 'data/leads_snapshot.pkl.gz',
+        # DataFrame ya procesado (Arrow IPC); se muestra al arrancar, aunque haya caducado,
+        # mientras el hilo de fondo consulta la API (ver lead_refresher)
+        'frame_path': 'data/leads_procesados.arrow',
+        # Cada cuánto se fuerza una descarga completa para reflejar leads eliminados
+        'dias_resincronizacion_completa': 7,
+        # Pipelines, usuarios y motivos de pérdida cambian rara vez
+        'horas_cache_referencia': 24,
+        # Cada cuánto el hilo de fondo vuelve a descargar los leads (se sigue mostrando lo anterior)
+        'minutos_refresco': 60,
+        # Espera antes de reintentar tras una actualización fallida
+        'minutos_reintento': 5,
+        # Cada cuánto los procesos que no publican revisan si hay un archivo nuevo
+        'segundos_sondeo': 5,
+    },
+    'scoring': {
+        # Modelo entrenado con 'python lead_model.py'; si no existe se usan solo las reglas
+        'modelo_path': 'data/modelo_scoring.joblib',
+        'min_muestras_entrenamiento': 50,
+    },
+    'motivos_perdida': {
+        # Etiqueta corta del motivo: primer texto contenido en el nombre (sin distinguir mayúsculas)
+        'etiquetas': [
+            ('ocupada', 'Unidad ocupada'),
+            ('respuesta', 'Sin respuesta'),
+            ('comparativo', 'Cuadro comparativo'),
+            ('descuento', 'Descuento'),
+            ('fuera', 'Fuera de servicio'),
+            ('operador', 'Sin operador'),
+            ('demanda', 'Baja demanda'),
+        ],
+        'largo_maximo_etiqueta': 15,  # Motivos sin etiqueta se recortan a este largo
+        # Motivos atribuibles a la capacidad operativa; el resto, al cliente o al mercado
+        'operativos': ['Unidad ocupada', 'Unidad sin operador', 'Unidad fuera de servicio', 'Sin unidades disponibles'],
+        'impacto_operativo': 'Capacidad Operativa\n(Flota/Personal)',
+        'impacto_externo': 'Factores del Cliente\n/ Mercado',
+    },
+    'reportes': {
+        'graficos_en_paralelo': True,
+        'procesos_graficos': None,  # None = núcleos disponibles
+        'cache_graficos_mb': 64,  # Tope de la caché de PNG (LRU) por proceso
+    },
     'colores': {
         'principal': '#A12D2D',
         'secundario': '#F0B400',
@@ -9,7 +9,6 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-import os
 import visualizations as viz # Usaremos nuestro módulo de gráficos
 from config import CONFIG # Importar la configuración para umbrales
 
@@ -86,18 +85,14 @@ def build_dashboard(df_master):
     col1, col2 = st.columns(2)
 
     with col1:
-        img_funnel_path = "temp_assets/funnel_dashboard.png"
-        viz.crear_funnel_ejecutivo(df_filtered, img_funnel_path)
-        if os.path.exists(img_funnel_path):
-            st.image(img_funnel_path, use_container_width=True)
-            os.remove(img_funnel_path)
+        img_funnel = viz.crear_funnel_ejecutivo(df_filtered)
+        if img_funnel is not None:
+            st.image(img_funnel, use_container_width=True)
 
     with col2:
-        img_salud_path = "temp_assets/salud_dashboard.png"
-        viz.crear_grafico_salud_leads(df_filtered, img_salud_path)
-        if os.path.exists(img_salud_path):
-            st.image(img_salud_path, use_container_width=True)
-            os.remove(img_salud_path)
+        img_salud = viz.crear_grafico_salud_leads(df_filtered)
+        if img_salud is not None:
+            st.image(img_salud, use_container_width=True)
 
     # Tablas de datos para análisis profundo
     st.markdown("---")
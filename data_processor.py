@@ -9,42 +9,143 @@
 import pandas as pd
 import numpy as np
 import unicodedata
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import streamlit as st
 import pytz # Importar pytz para manejar zonas horarias
 
 from config import CONFIG
 
+def plegar_texto(texto):
+    """Minúsculas y sin acentos ('Grúa Élite' -> 'grua elite'), para comparar textos."""
+    return ''.join(c for c in unicodedata.normalize('NFD', texto.lower()) if unicodedata.category(c) != 'Mn')
+
 def normalizar_texto(texto):
     if not isinstance(texto, str): return texto
-    s = ''.join(c for c in unicodedata.normalize('NFD', texto.lower()) if unicodedata.category(c) != 'Mn')
-    return s.title()
+    return plegar_texto(texto).title()
+
+CLIENTE_DESCONOCIDO = 'Cliente Desconocido'
+
+def _nombre_contacto(embedded):
+    """Nombre del primer contacto asociado al lead, con acceso seguro a la estructura."""
+    contactos = (embedded or {}).get('contacts') or []
+    if contactos and isinstance(contactos[0], dict):
+        return contactos[0].get('name', CLIENTE_DESCONOCIDO)
+    return CLIENTE_DESCONOCIDO
+
+def normalizar_leads(leads):
+    """
+    Convierte una página de leads crudos (dicts de la API) en un bloque columnar.
+    Extrae de '_embedded' las etiquetas y el nombre del contacto y descarta los
+    payloads anidados, para que los dicts crudos se puedan liberar de inmediato.
+    """
+    embedded = [lead.get('_embedded') or {} for lead in leads]
+    df = pd.DataFrame(leads, columns=None if leads else ['id', 'updated_at'])
+    df = df.drop(columns=['_embedded', '_links'], errors='ignore')
+    df['tags'] = [[tag['name'] for tag in e.get('tags', [])] for e in embedded]
+    df['contacto_nombre'] = [_nombre_contacto(e) for e in embedded]
+    return df
+
+# Columnas de fecha de la API y el nombre de su clave de día local
+COLUMNAS_FECHA = {'created_at': 'dia_creado', 'updated_at': 'dia_actualizado', 'closed_at': 'dia_cerrado'}
+# Clave de día para fechas vacías (p. ej. leads sin cerrar)
+SIN_FECHA = -1
+
+def dia_clave(fecha):
+    """Clave entera de un día: días transcurridos desde 1970-01-01."""
+    return (fecha - date(1970, 1, 1)).days
+
+def fecha_de_clave(clave):
+    """Inversa de dia_clave."""
+    return date(1970, 1, 1) + timedelta(days=int(clave))
+
+def claves_de_dia(fechas_locales):
+    """Claves de día (int32) de una columna datetime en hora local; SIN_FECHA para NaT."""
+    dias = fechas_locales.dt.tz_localize(None).to_numpy(dtype='datetime64[D]')
+    claves = dias.astype('int64')
+    claves[np.isnat(dias)] = SIN_FECHA
+    return claves.astype('int32')
+
+def construir_tabla_etapas(pipelines):
+    """
+    Tabla de etapas indexada por status_id, con el nombre normalizado (calculado una
+    vez por etapa, no por lead) y el nombre del pipeline. Si un status_id se repite
+    entre pipelines (p. ej. 142/143) prevalece el último, igual que un dict.
+    """
+    filas = [
+        {'status_id': s['id'], 'etapa_nombre': s['name'], 'pipeline_nombre': p['name']}
+        for p in pipelines for s in p['_embedded']['statuses']
+    ]
+    tabla = pd.DataFrame(filas, columns=['status_id', 'etapa_nombre', 'pipeline_nombre'])
+    tabla = tabla.drop_duplicates('status_id', keep='last').set_index('status_id')
+    tabla['etapa_nombre'] = tabla['etapa_nombre'].map(normalizar_texto)
+    return tabla
+
+def construir_tabla_motivos(motivos):
+    """
+    Etiqueta corta e impacto de cada motivo de pérdida distinto según la taxonomía
+    de CONFIG['motivos_perdida'], indexada por el nombre del motivo. Se calcula por
+    motivo (hay pocos), no por lead.
+    """
+    taxonomia = CONFIG['motivos_perdida']
+    operativos = [m.lower() for m in taxonomia['operativos']]
+    filas = []
+    for motivo in motivos:
+        texto = motivo.lower() if isinstance(motivo, str) else ''
+        corto = next((etiqueta for clave, etiqueta in taxonomia['etiquetas'] if clave in texto), None)
+        if corto is None:
+            corto = motivo[:taxonomia['largo_maximo_etiqueta']] if texto else 'No especificado'
+        operativo = any(m in texto for m in operativos)
+        filas.append({
+            'motivo_perdida_nombre': motivo,
+            'motivo_corto': corto,
+            'impacto_perdida': taxonomia['impacto_operativo'] if operativo else taxonomia['impacto_externo'],
+        })
+    return pd.DataFrame(filas, columns=['motivo_perdida_nombre', 'motivo_corto', 'impacto_perdida']).set_index('motivo_perdida_nombre')
+
+# Columnas de texto con pocos valores distintos que se guardan como categóricas
+COLUMNAS_CATEGORICAS = ['responsable_nombre', 'etapa_nombre', 'pipeline_nombre', 'estado', 'motivo_perdida_nombre',
+                        'motivo_corto', 'impacto_perdida', 'salud_lead']
+# Payloads anidados que no se usan en el análisis y no deben viajar en el DataFrame maestro
+COLUMNAS_ANIDADAS = ['custom_fields_values', '_embedded', '_links']
+
+def compactar_tipos(df):
+    """Reduce la memoria del DataFrame: categóricas para textos repetidos e ids enteros al menor ancho posible."""
+    for col in COLUMNAS_CATEGORICAS:
+        df[col] = df[col].astype('category')
+    for col in df.select_dtypes('integer').columns:
+        if col == 'id' or col.endswith('_id'):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in ['dias_para_cerrar', 'dias_sin_actualizar']:
+        df[col] = pd.to_numeric(df[col], downcast='float')
+    return df
 
 def procesar_datos(api_data):
-    if not api_data or not api_data.get('leads'):
+    leads = api_data.get('leads') if api_data else None
+    if leads is None or len(leads) == 0:
         st.error("No se encontraron leads para procesar.")
         return pd.DataFrame()
     
-    df = pd.DataFrame(api_data['leads'])
+    # Los leads llegan normalizados desde kommo_api; una lista de dicts crudos también se acepta.
+    # Copia superficial: las columnas se reemplazan sin tocar el DataFrame de quien llama
+    df = leads.copy(deep=False) if isinstance(leads, pd.DataFrame) else normalizar_leads(leads)
     user_map = {user['id']: user['name'] for user in api_data['users']}
     loss_reason_map = {reason['id']: reason['name'] for reason in api_data['loss_reasons']}
-    pipeline_map, status_map = {}, {}
-    for p in api_data['pipelines']:
-        pipeline_map[p['id']] = p['name']
-        for s in p['_embedded']['statuses']: status_map[s['id']] = {'name': s['name'], 'pipeline_id': p['id']}
+    tabla_etapas = construir_tabla_etapas(api_data['pipelines'])
     
     df['responsable_nombre'] = df['responsible_user_id'].map(user_map).fillna('No asignado')
-    df['etapa_nombre'] = df['status_id'].apply(lambda x: status_map.get(x, {}).get('name', 'Etapa Desconocida')).apply(normalizar_texto)
-    df['pipeline_nombre'] = df['status_id'].apply(lambda x: status_map.get(x, {}).get('pipeline_id')).map(pipeline_map)
+    df['etapa_nombre'] = df['status_id'].map(tabla_etapas['etapa_nombre']).fillna('Etapa Desconocida')
+    df['pipeline_nombre'] = df['status_id'].map(tabla_etapas['pipeline_nombre'])
     df['motivo_perdida_nombre'] = df['loss_reason_id'].map(loss_reason_map).fillna('No especificado')
-    df['tags'] = df.apply(lambda lead: [tag['name'] for tag in lead.get('_embedded', {},).get('tags', [])], axis=1)
+    tabla_motivos = construir_tabla_motivos(df['motivo_perdida_nombre'].unique())
+    df['motivo_corto'] = df['motivo_perdida_nombre'].map(tabla_motivos['motivo_corto'])
+    df['impacto_perdida'] = df['motivo_perdida_nombre'].map(tabla_motivos['impacto_perdida'])
     
     # --- CORRECCIÓN DE ZONA HORARIA (RAÍZ) ---
     # 1. Convertir las fechas de la API a datetime y marcarlas como UTC (que es como vienen)
-    for col in ['created_at', 'updated_at', 'closed_at']:
+    for col in COLUMNAS_FECHA:
         df[col] = pd.to_datetime(df[col], unit='s', errors='coerce').dt.tz_localize('UTC')
     
-    df = df[df['pipeline_nombre'] != CONFIG['pipeline_a_excluir']]
+    df = df[df['pipeline_nombre'] != CONFIG['pipeline_a_excluir']].reset_index(drop=True)
     
     # Unificar 'Proceso de Cobro' y 'Ganado' como 'Ganado'
     condiciones = [
@@ -60,12 +161,19 @@ def procesar_datos(api_data):
     now_utc = datetime.now(pytz.utc)
     df['dias_sin_actualizar'] = (now_utc - df['updated_at']).dt.days
     
-    def get_lead_health(row):
-        if row['estado'] != 'En Trámite': return 'N/A'
-        if row['dias_sin_actualizar'] >= CONFIG['dias_lead_critico']: return 'Crítico'
-        if row['dias_sin_actualizar'] >= CONFIG['dias_lead_en_riesgo']: return 'En Riesgo'
-        return 'Saludable'
-        
-    df['salud_lead'] = df.apply(get_lead_health, axis=1)
+    # Salud del lead: solo aplica a los leads en trámite, según los días sin actualizar
+    condiciones_salud = [
+        df['estado'] != 'En Trámite',
+        df['dias_sin_actualizar'] >= CONFIG['dias_lead_critico'],
+        df['dias_sin_actualizar'] >= CONFIG['dias_lead_en_riesgo']
+    ]
+    df['salud_lead'] = np.select(condiciones_salud, ['N/A', 'Crítico', 'En Riesgo'], default='Saludable')
+    
+    # 3. Fechas en hora local y claves enteras de día, calculadas una sola vez: los
+    #    filtros por día de las páginas comparan enteros en lugar de convertir zonas horarias
+    for col, col_dia in COLUMNAS_FECHA.items():
+        df[f'{col}_local'] = df[col].dt.tz_convert(CONFIG['zona_horaria'])
+        df[col_dia] = claves_de_dia(df[f'{col}_local'])
     
-    return df
+    df = df.drop(columns=COLUMNAS_ANIDADAS, errors='ignore')
+    return compactar_tipos(df)
@@ -23,8 +23,8 @@ def debug_fechas_reales():
             
             # Contar leads por año
             st.subheader("📊 Distribución por Año")
-            df['year'] = df['created_at'].dt.year
-            year_counts = df['year'].value_counts().sort_index()
+            # Sin agregar columnas: el DataFrame es el mismo para todas las sesiones
+            year_counts = df['created_at'].dt.year.value_counts().sort_index()
             st.bar_chart(year_counts)
             
             # Mostrar algunos ejemplos de fechas
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# GENERACIÓN DE REPORTES EN LOTE (LÍNEA DE COMANDOS)
+# =============================================================================
+# Responsabilidad: Generar sin la interfaz de Streamlit un lote de reportes PDF
+# (por semana, por mes, por ejecutivo y comparativos entre periodos) para
+# ejecuciones programadas. Los datos se cargan una sola vez desde el
+# DataFrame procesado que guarda la app (ver lead_store) y los reportes se
+# reparten entre procesos.
+#
+# Ejemplos:
+#   python generar_reportes.py --semanas 4 --meses 2 --por-ejecutivo
+#   python generar_reportes.py --desde 2025-01-01 --hasta 2025-03-31 --comparativos
+# =============================================================================
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+import pytz
+
+from config import CONFIG
+import lead_store
+
+# Estado de cada proceso de trabajo (se carga una vez en _inicializar)
+_datos = {}
+
+def _inicializar(path_frame):
+    """Carga el DataFrame (memory-map) y construye índice y cubo una sola vez por proceso."""
+    # Importaciones pesadas (matplotlib, fpdf) solo en los procesos que generan reportes
+    from lead_index import LeadIndex
+    from lead_rollup import CuboLeads
+    from pdf_generator import ReportGenerator
+    from streamlit import config as st_config
+    from streamlit.logger import set_log_level
+
+    # Fuera de la app, Streamlit avisa de que no hay sesión en cada st.success/st.warning
+    st_config.set_option('global.showWarningOnDirectExecution', False)
+    set_log_level('error')
+
+    df, _ = lead_store.cargar_frame(path_frame)
+    _datos.update(
+        df=df,
+        indice=LeadIndex(df),
+        cubo=CuboLeads.desde_leads(df),
+        reporter=ReportGenerator(df),
+    )
+
+def _inicializar_trabajador(path_frame):
+    """Inicializador del pool: cada proceso ya es uno de los trabajadores, así que dibuja sus gráficos en serie."""
+    CONFIG['reportes']['graficos_en_paralelo'] = False
+    _inicializar(path_frame)
+
+def _generar(trabajo):
+    """Genera un trabajo. Devuelve (trabajo, archivos generados, error o None)."""
+    reporter, cubo = _datos['reporter'], _datos['cubo']
+    try:
+        if trabajo['tipo'] == 'comparativo':
+            df_a = _leads_periodo(trabajo['inicio'], trabajo['fin'])
+            df_b = _leads_periodo(trabajo['inicio_b'], trabajo['fin_b'])
+            archivo = reporter.generar_reporte_comparativo(
+                df_a, df_b, _rango(trabajo['inicio'], trabajo['fin']), _rango(trabajo['inicio_b'], trabajo['fin_b']), trabajo['archivo'])
+        elif trabajo['tipo'] == 'ejecutivos':
+            # Todos los ejecutivos del periodo en un solo trabajo (una sola agrupación de los datos)
+            return trabajo, reporter.generar_reportes_por_ejecutivo(
+                _leads_periodo(trabajo['inicio'], trabajo['fin']), trabajo['carpeta'], trabajo['nombre_base'], trabajo['titulo'],
+                cubo=cubo.filtrar(trabajo['inicio'], trabajo['fin'])), None
+        else:
+            archivo = reporter.generar_reporte_por_fechas(
+                _leads_periodo(trabajo['inicio'], trabajo['fin']), trabajo['archivo'], trabajo['titulo'],
+                cubo=cubo.filtrar(trabajo['inicio'], trabajo['fin']))
+        return trabajo, [archivo] if archivo else [], None
+    except Exception as e:
+        return trabajo, [], f"{type(e).__name__}: {e}"
+
+def _leads_periodo(inicio, fin):
+    return _datos['df'].iloc[_datos['indice'].filtrar(inicio, fin)]
+
+def _rango(inicio, fin):
+    return f"{inicio:%Y-%m-%d} a {fin:%Y-%m-%d}"
+
+def semanas_completas(hoy, n):
+    """Las últimas 'n' semanas completas (lunes a domingo) antes de 'hoy', de la más antigua a la más reciente."""
+    lunes_actual = hoy - timedelta(days=hoy.weekday())
+    return [(lunes_actual - timedelta(weeks=i), lunes_actual - timedelta(weeks=i) + timedelta(days=6)) for i in range(n, 0, -1)]
+
+def meses_completos(hoy, n):
+    """Los últimos 'n' meses completos antes de 'hoy', del más antiguo al más reciente."""
+    periodos = []
+    fin = hoy.replace(day=1) - timedelta(days=1)
+    for _ in range(n):
+        inicio = fin.replace(day=1)
+        periodos.append((inicio, fin))
+        fin = inicio - timedelta(days=1)
+    return periodos[::-1]
+
+def periodo_anterior(inicio, fin, tipo):
+    """Periodo con el que se compara: el mes natural anterior, o los mismos días justo antes."""
+    if tipo == 'Mes':
+        fin_b = inicio - timedelta(days=1)
+        return fin_b.replace(day=1), fin_b
+    duracion = fin - inicio + timedelta(days=1)
+    return inicio - duracion, fin - duracion
+
+def planificar(args, hoy):
+    """Lista de reportes a generar según los argumentos."""
+    periodos = [(inicio, fin, 'Semana') for inicio, fin in semanas_completas(hoy, args.semanas)]
+    periodos += [(inicio, fin, 'Mes') for inicio, fin in meses_completos(hoy, args.meses)]
+    if args.desde or args.hasta:
+        periodos.append((args.desde or date(2000, 1, 1), args.hasta or hoy, 'Periodo'))
+
+    trabajos = []
+    for inicio, fin, tipo in periodos:
+        base = f"Reporte_Kommo_{inicio}_a_{fin}"
+        trabajos.append({
+            'tipo': 'periodo', 'inicio': inicio, 'fin': fin,
+            'titulo': f"Análisis {tipo} {inicio} a {fin}",
+            'archivo': os.path.join(args.salida, f"{base}.pdf"),
+        })
+        if args.por_ejecutivo:
+            trabajos.append({
+                'tipo': 'ejecutivos', 'inicio': inicio, 'fin': fin,
+                'titulo': f"Análisis {tipo} {inicio} a {fin}",
+                'carpeta': args.salida, 'nombre_base': base,
+                'archivo': os.path.join(args.salida, f"{base}_Indice.pdf"),
+            })
+        if args.comparativos:
+            inicio_b, fin_b = periodo_anterior(inicio, fin, tipo)
+            trabajos.append({
+                'tipo': 'comparativo', 'inicio': inicio, 'fin': fin, 'inicio_b': inicio_b, 'fin_b': fin_b,
+                'archivo': os.path.join(args.salida, f"Reporte_Comparativo_{inicio}_vs_{inicio_b}.pdf"),
+            })
+    return trabajos
+
+def _fecha(texto):
+    try:
+        return datetime.strptime(texto, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Fecha no válida '{texto}' (formato AAAA-MM-DD)")
+
+def crear_parser():
+    parser = argparse.ArgumentParser(description="Genera un lote de reportes PDF de Kommo sin abrir la app.")
+    parser.add_argument('--semanas', type=int, default=0, help="Reportes de las últimas N semanas completas (lunes a domingo).")
+    parser.add_argument('--meses', type=int, default=0, help="Reportes de los últimos N meses completos.")
+    parser.add_argument('--desde', type=_fecha, help="Inicio de un periodo manual (AAAA-MM-DD).")
+    parser.add_argument('--hasta', type=_fecha, help="Fin de un periodo manual (AAAA-MM-DD, por defecto hoy).")
+    parser.add_argument('--por-ejecutivo', action='store_true', help="Además, un reporte por ejecutivo en cada periodo, con un reporte índice.")
+    parser.add_argument('--comparativos', action='store_true', help="Además, cada periodo comparado con el anterior.")
+    parser.add_argument('--salida', default='reports', help="Carpeta de destino (por defecto: reports).")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos en paralelo (por defecto: núcleos disponibles).")
+    parser.add_argument('--frame', default=CONFIG['sync']['frame_path'], help="DataFrame procesado guardado por la app.")
+    return parser
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+
+    metadata = lead_store.leer_metadata_frame(args.frame)
+    if metadata is None:
+        print(f"No hay datos procesados en '{args.frame}'. Abre la app una vez para generarlos.")
+        return 1
+    edad_horas = (time.time() - metadata['fetched_at']) / 3600
+    if edad_horas > CONFIG['cache_duration_hours']:
+        print(f"Aviso: los datos tienen {edad_horas:.1f} h; los reportes no incluirán cambios posteriores.")
+
+    hoy = datetime.now(pytz.timezone(CONFIG['zona_horaria'])).date()
+    trabajos = planificar(args, hoy)
+    if not trabajos:
+        print("No se pidió ningún reporte (usa --semanas, --meses o --desde/--hasta).")
+        return 1
+    os.makedirs(args.salida, exist_ok=True)
+
+    procesos = min(args.procesos or os.cpu_count() or 1, len(trabajos))
+    print(f"Generando {len(trabajos)} trabajo(s) de reportes con {procesos} proceso(s)...")
+    inicio = time.perf_counter()
+    if procesos > 1:
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_inicializar_trabajador, initargs=(args.frame,)) as pool:
+            resultados = [f.result() for f in as_completed([pool.submit(_generar, t) for t in trabajos])]
+    else:
+        _inicializar(args.frame)
+        resultados = [_generar(t) for t in trabajos]
+
+    fallidos = generados = 0
+    for trabajo, archivos, error in sorted(resultados, key=lambda r: r[0]['archivo']):
+        if error:
+            fallidos += 1
+            print(f"  ERROR  {trabajo['archivo']}: {error}")
+        elif not archivos:
+            print(f"  vacío  {trabajo['archivo']} (sin leads en el periodo)")
+        for archivo in archivos:
+            generados += 1
+            print(f"  ok     {archivo}")
+    print(f"Listo en {time.perf_counter() - inicio:.1f} s: {generados} PDF(s), {fallidos} trabajo(s) con errores.")
+    return 1 if fallidos else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,72 +1,461 @@
 # -*- coding: utf-8 -*-
 import requests
+from requests.adapters import HTTPAdapter
 import time
+import random
+import statistics
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from config import CONFIG
+import lead_store
+from data_processor import normalizar_leads
+
+class RateLimiter:
+    """Token bucket compartido entre hilos para respetar el límite de peticiones por segundo."""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea hasta que haya un token disponible y lo consume."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class KommoAPIError(Exception):
+    """Petición fallida tras agotar los reintentos (o por un error no recuperable)."""
+    def __init__(self, url, message, status_code=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.url = url
+        self.status_code = status_code
+        # True si la causa era transitoria (429, 5xx, red): tiene sentido volver a intentarlo más tarde
+        self.retryable = retryable
+        # Segundos de espera pedidos por el servidor cuando superan 'espera_maxima_retry_after'
+        self.retry_after = retry_after
+
+class IncompletePaginationError(Exception):
+    """
+    La paginación se interrumpió a medias. Guarda lo descargado hasta el fallo y el
+    punto de reanudación para pasarlo a `get_all_pages(..., resume=error)`.
+    """
+    def __init__(self, endpoint, items, next_url=None, next_page=None, cause=None):
+        super().__init__(f"Paginación incompleta en '{endpoint}' ({len(items)} items descargados): {cause}")
+        self.endpoint = endpoint
+        self.items = items
+        self.next_url = next_url
+        self.next_page = next_page
+        self.cause = cause
+
+    @property
+    def retryable(self):
+        """Solo se reanuda si la página falló por una causa transitoria (no por 401/403/404)."""
+        return getattr(self.cause, 'retryable', False)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+def _parse_retry_after(value):
+    """Interpreta la cabecera Retry-After (segundos o fecha HTTP). Devuelve segundos o None."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def _thread_pool(max_workers):
+    """
+    Pool de hilos cuyos hilos heredan el contexto de Streamlit para poder mostrar
+    mensajes, y el nombre del hilo que lo crea como prefijo (p. ej. para saber que
+    trabajan para el refrescador de fondo).
+    """
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=threading.current_thread().name,
+                              initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx))
+
+def _timed(fn, *args, **kwargs):
+    """Ejecuta `fn` y devuelve (resultado, segundos transcurridos)."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
 
 class KommoAPI:
-    def __init__(self, base_url, headers):
+    def __init__(self, base_url, headers, max_workers=None, requests_per_second=None, pool_size=None, timeout=None):
+        cfg = CONFIG['api']
         self.base_url = base_url
         self.headers = headers
+        self.max_workers = max_workers or cfg['max_workers']
+        self.rate_limiter = RateLimiter(requests_per_second or cfg['requests_por_segundo'])
+        self.timeout = timeout or (cfg['timeout_conexion'], cfg['timeout_lectura'])
 
-    def _make_request(self, url):
-        """Hace una petición a la API y maneja los errores."""
-        try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()  # Lanza un error para respuestas 4xx/5xx
-            return response.json()
-        except requests.exceptions.HTTPError as http_err:
-            st.error(f"Error de HTTP en la petición a {url}: {http_err}")
+        # Sesión con keep-alive: reutiliza las conexiones TLS entre páginas
+        pool_size = pool_size or cfg['pool_conexiones']
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(headers)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        self._latencies = []
+        self._latencies_lock = threading.Lock()
+        self._retry_budget = {}
+        self._retry_lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+
+    def _record_latency(self, url, response, total):
+        # 'elapsed' mide hasta recibir las cabeceras (conexión + espera del servidor);
+        # el resto del tiempo total es la descarga del cuerpo
+        ttfb = response.elapsed.total_seconds()
+        with self._latencies_lock:
+            self._latencies.append({
+                'url': url,
+                'status': response.status_code,
+                'ttfb': ttfb,
+                'descarga': max(total - ttfb, 0.0),
+                'total': total,
+                'bytes': len(response.content),
+            })
+
+    def get_latency_stats(self):
+        """Resumen de latencias por petición: espera hasta cabeceras vs. descarga del cuerpo."""
+        with self._latencies_lock:
+            latencies = list(self._latencies)
+        if not latencies:
+            return {'peticiones': 0}
+        totals = [l['total'] for l in latencies]
+        return {
+            'peticiones': len(latencies),
+            'tiempo_total': sum(totals),
+            'ttfb_promedio': statistics.mean(l['ttfb'] for l in latencies),
+            'descarga_promedio': statistics.mean(l['descarga'] for l in latencies),
+            'total_p50': statistics.median(totals),
+            'total_max': max(totals),
+            'bytes_totales': sum(l['bytes'] for l in latencies),
+        }
+
+    def reset_retry_budget(self, endpoint):
+        with self._retry_lock:
+            self._retry_budget.pop(endpoint, None)
+
+    def _consume_retry(self, endpoint):
+        """Descuenta un reintento del presupuesto del endpoint. False si ya se agotó."""
+        with self._retry_lock:
+            remaining = self._retry_budget.get(endpoint, CONFIG['api']['presupuesto_reintentos'])
+            if remaining <= 0:
+                return False
+            self._retry_budget[endpoint] = remaining - 1
+            return True
+
+    def _backoff_delay(self, attempt, response=None):
+        """Retry-After completo si el servidor lo indica; si no, backoff exponencial con jitter completo."""
+        cfg = CONFIG['api']
+        if response is not None:
+            retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return retry_after
+        return random.uniform(0, min(cfg['backoff_maximo'], cfg['backoff_base'] * 2 ** attempt))
+
+    def _make_request(self, url, endpoint=None):
+        """
+        Hace una petición a la API y maneja los errores. Reintenta los 429, 5xx y
+        errores de red; lanza KommoAPIError si no se puede completar.
+        """
+        endpoint = endpoint or url
+        max_attempts = CONFIG['api']['reintentos_maximos'] + 1
+        retry_after = None
+        for attempt in range(max_attempts):
+            self.rate_limiter.acquire()
+            response = None
+            try:
+                start = time.perf_counter()
+                response = self.session.get(url, timeout=self.timeout)
+                self._record_latency(url, response, time.perf_counter() - start)
+                response.raise_for_status()  # Lanza un error para respuestas 4xx/5xx
+                if response.status_code == 204:
+                    # Kommo responde 204 (sin contenido) al pedir una página posterior a la última
+                    return None
+                return response.json()
+            except requests.exceptions.HTTPError as http_err:
+                error = http_err
+                retryable = response.status_code in RETRYABLE_STATUS
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+                retryable = True
+            except requests.exceptions.RequestException as e:
+                error = e
+                retryable = False
+
+            if retryable and attempt + 1 < max_attempts:
+                delay = self._backoff_delay(attempt, response)
+                if delay > CONFIG['api']['espera_maxima_retry_after']:
+                    # No se reintenta antes de lo pedido (sería otro 429); se deja para más tarde
+                    retry_after = delay
+                    break
+                if self._consume_retry(endpoint):
+                    time.sleep(delay)
+                    continue
+            break
+
+        status_code = response.status_code if response is not None else None
+        if isinstance(error, requests.exceptions.HTTPError):
+            st.error(f"Error de HTTP en la petición a {url}: {error}")
             # Específicamente para errores de autenticación
-            if response.status_code == 401:
+            if status_code == 401:
                 st.error("Error de autenticación (401). Verifica que tus 'secrets' en Streamlit Cloud sean correctos.")
-        except requests.exceptions.RequestException as e:
-            st.error(f"Error en la petición a {url}: {e}")
-        return None
+        else:
+            st.error(f"Error en la petición a {url}: {error}")
+        if retry_after is not None:
+            st.error(f"Kommo pidió esperar {retry_after:.0f} s antes de reintentar; la descarga se reanudará más tarde.")
+        raise KommoAPIError(url, str(error), status_code, retryable=retryable, retry_after=retry_after)
 
-    def get_all_pages(self, endpoint, params=None):
-        """Obtiene datos de todos las páginas de un endpoint de la API."""
-        all_data = []
+    def _build_url(self, endpoint, params=None):
         url = f"{self.base_url}/{endpoint}"
         if params:
             url += "?" + "&".join([f"{k}={v}" for k, v in params.items()])
+        return url
+
+    @staticmethod
+    def _extract_items(data):
+        """Devuelve la lista de items de una respuesta paginada, o None si no hay datos."""
+        if not data or '_embedded' not in data:
+            return None
+        # La clave de los items puede variar (e.g., 'leads', 'users')
+        item_key = list(data['_embedded'].keys())[0]
+        return data['_embedded'][item_key]
+
+    def get_all_pages(self, endpoint, params=None, parallel=False, resume=None):
+        """
+        Obtiene datos de todos las páginas de un endpoint de la API. Si una página
+        falla tras los reintentos lanza IncompletePaginationError; pasando ese error
+        como `resume` se continúa desde la página fallida sin repetir las anteriores.
+        """
+        all_data = list(resume.items) if resume else []
+        try:
+            for items in self.iter_pages(endpoint, params, parallel, resume):
+                all_data.extend(items)
+        except IncompletePaginationError as e:
+            e.items = all_data
+            raise
+        return all_data
 
-        page_num = 1
+    def iter_pages(self, endpoint, params=None, parallel=False, resume=None):
+        """
+        Generador que entrega los items de cada página, en orden, a medida que llegan.
+        Lanza IncompletePaginationError (sin items; los acumula quien consume) si una página falla.
+        """
         with st.spinner(f"Cargando datos desde el endpoint '{endpoint}'..."):
+            if parallel:
+                yield from self._iter_pages_parallel(endpoint, params, resume)
+                return
+
+            url = resume.next_url if resume else self._build_url(endpoint, params)
             while url:
-                data = self._make_request(url)
-                if data and '_embedded' in data:
-                    # La clave de los items puede variar (e.g., 'leads', 'users')
-                    item_key = list(data['_embedded'].keys())[0]
-                    all_data.extend(data['_embedded'][item_key])
-                    
+                try:
+                    data = self._make_request(url, endpoint)
+                except KommoAPIError as e:
+                    raise IncompletePaginationError(endpoint, [], next_url=url, cause=e) from e
+                items = self._extract_items(data)
+                if items is not None:
+                    yield items
                     # Obtener la URL de la siguiente página
                     url = data.get('_links', {}).get('next', {}).get('href')
-                    page_num += 1
-                    time.sleep(0.2) # Pequeña pausa para no saturar la API
                 else:
-                    # Si no hay más datos o hubo un error, detenemos el bucle
+                    # Si no hay más datos detenemos el bucle
                     url = None
-        return all_data
 
-def get_api_data(base_url, headers):
+    def _iter_pages_parallel(self, endpoint, params=None, resume=None):
+        """
+        Pide las páginas por número de forma concurrente, manteniendo hasta
+        `max_workers` peticiones en vuelo, y las entrega en orden.
+        """
+        page_params = dict(params or {})
+        page_params['limit'] = CONFIG['api']['limite_por_pagina']
+
+        def fetch(page):
+            return self._make_request(self._build_url(endpoint, {**page_params, 'page': page}), endpoint)
+
+        page = resume.next_page if resume else 1
+        with _thread_pool(self.max_workers) as executor:
+            futures = {p: executor.submit(fetch, p) for p in range(page, page + self.max_workers)}
+            next_page = page + self.max_workers
+            try:
+                while page in futures:
+                    try:
+                        data = futures.pop(page).result()
+                    except KommoAPIError as e:
+                        raise IncompletePaginationError(endpoint, [], next_page=page, cause=e) from e
+                    items = self._extract_items(data)
+                    # Una página vacía o sin enlace 'next' marca el final del endpoint
+                    is_last = not items or not data.get('_links', {}).get('next')
+                    if not is_last:
+                        futures[next_page] = executor.submit(fetch, next_page)
+                        next_page += 1
+                    if items:
+                        yield items
+                    if is_last:
+                        break
+                    page += 1
+            finally:
+                for future in futures.values():
+                    future.cancel()
+
+def fetch_endpoint(api, endpoint, params=None, parallel=False, on_page=None):
+    """
+    Descarga un endpoint completo, reanudando desde la página fallida (con el
+    presupuesto de reintentos renovado) hasta `reanudaciones_maximas` veces.
+    Los errores no recuperables (p. ej. 401, 403, 404) se propagan sin reanudar, igual
+    que un 429 cuyo Retry-After supera 'espera_maxima_retry_after'.
+    Si se indica `on_page`, cada página se transforma al llegar y se devuelve la
+    lista de resultados; así no se retienen los dicts crudos de toda la descarga.
+    """
+    results = []
+    resume = None
+    for _ in range(CONFIG['api']['reanudaciones_maximas'] + 1):
+        try:
+            for items in api.iter_pages(endpoint, params=params, parallel=parallel, resume=resume):
+                if on_page:
+                    results.append(on_page(items))
+                else:
+                    results.extend(items)
+            return results
+        except IncompletePaginationError as e:
+            e.items = results
+            if not e.retryable or getattr(e.cause, 'retry_after', None) is not None:
+                raise
+            resume = e
+            api.reset_retry_budget(endpoint)
+    raise resume
+
+def fetch_lead_frame(api, params, parallel, progress=None):
+    """
+    Descarga los leads normalizando cada página en un bloque columnar al llegar,
+    y concatena los bloques al final. `progress(n)` recibe el total de leads recibidos.
+    """
+    received = 0
+
+    def on_page(items):
+        nonlocal received
+        chunk = normalizar_leads(items)
+        received += len(chunk)
+        if progress:
+            progress(received)
+        return chunk
+
+    chunks = fetch_endpoint(api, 'leads', params=params, parallel=parallel, on_page=on_page)
+    return pd.concat(chunks, ignore_index=True) if chunks else normalizar_leads([])
+
+def get_leads(api, incremental=True, progress=None):
+    """
+    Obtiene los leads (ya normalizados en un DataFrame). En modo incremental parte
+    del último snapshot en disco y solo pide a la API los leads actualizados desde
+    su 'high water mark'.
+    """
+    cfg = CONFIG['sync']
+    params = {'with': 'loss_reason,contacts'}
+    parallel = CONFIG['api']['paginacion_paralela']
+    now = int(time.time())
+
+    snapshot = lead_store.cargar_snapshot(cfg['snapshot_path']) if incremental else None
+    if snapshot and now - snapshot['full_sync_at'] > cfg['dias_resincronizacion_completa'] * 86400:
+        snapshot = None
+
+    if not snapshot:
+        leads = fetch_lead_frame(api, params, parallel, progress)
+        if incremental and not leads.empty:
+            lead_store.guardar_snapshot(cfg['snapshot_path'], leads, full_sync_at=now)
+        return leads
+
+    # El filtro es inclusivo: los leads en el límite se vuelven a pedir y se deduplican por 'id'
+    params['filter[updated_at][from]'] = snapshot['high_water_mark']
+    nuevos = fetch_lead_frame(api, params, parallel, progress)
+    if nuevos.empty:
+        return snapshot['leads']
+    leads = lead_store.fusionar_leads(snapshot['leads'], nuevos)
+    lead_store.guardar_snapshot(cfg['snapshot_path'], leads, full_sync_at=snapshot['full_sync_at'])
+    return leads
+
+# Endpoints de catálogo: cambian rara vez y no dependen de los leads
+REFERENCE_ENDPOINTS = {
+    'pipelines': 'leads/pipelines',
+    'users': 'users',
+    'loss_reasons': 'leads/loss_reasons',
+}
+
+@st.cache_data(ttl=CONFIG['sync']['horas_cache_referencia'] * 3600, show_spinner=False)
+def get_reference_data(base_url, _api):
+    """
+    Descarga en paralelo pipelines, usuarios y motivos de pérdida. Se cachea por
+    separado y con más duración que los leads, así una recarga solo paga por los leads.
+    Los tiempos devueltos corresponden a la descarga que llenó la caché.
+    """
+    with _thread_pool(len(REFERENCE_ENDPOINTS)) as executor:
+        futures = {key: executor.submit(_timed, fetch_endpoint, _api, endpoint)
+                   for key, endpoint in REFERENCE_ENDPOINTS.items()}
+        results = {key: future.result() for key, future in futures.items()}
+    data = {key: result for key, (result, _) in results.items()}
+    data['timings'] = {REFERENCE_ENDPOINTS[key]: elapsed for key, (_, elapsed) in results.items()}
+    return data
+
+def get_api_data(base_url, headers, progress=None):
     """
     Función principal para obtener todos los datos necesarios de la API.
     Esta función es la que será cacheada por @st.cache_data en la página principal.
+    Los leads y los catálogos se piden a la vez; 'timings' desglosa el tiempo por endpoint.
+    Si una descarga no se completa lanza IncompletePaginationError (su 'cause' trae el
+    KommoAPIError con el 'status_code').
     """
     api = KommoAPI(base_url, headers)
-    
+    start = time.perf_counter()
+
     # Realizar todas las llamadas a la API
-    data = {
-        'leads': api.get_all_pages('leads', params={'with': 'loss_reason,contacts'}),
-        'pipelines': api.get_all_pages('leads/pipelines'),
-        'users': api.get_all_pages('users'),
-        'loss_reasons': api.get_all_pages('leads/loss_reasons')
-    }
-    
+    try:
+        with _thread_pool(2) as executor:
+            leads_future = executor.submit(_timed, get_leads, api, incremental=CONFIG['sync']['incremental'], progress=progress)
+            reference_future = executor.submit(_timed, get_reference_data, base_url, api)
+            leads, leads_time = leads_future.result()
+            reference, reference_time = reference_future.result()
+    except IncompletePaginationError as e:
+        # Nunca devolvemos un conjunto parcial: quedaría cacheado como si estuviera completo.
+        # Se propaga para que quien llama conozca la causa (p. ej. un 401 por token vencido)
+        st.error(f"No se pudo completar la descarga de '{e.endpoint}' tras varios reintentos ({len(e.items)} registros recibidos).")
+        raise
+    finally:
+        api.close()
+
+    data = {'leads': leads}
+    data.update({key: reference[key] for key in REFERENCE_ENDPOINTS})
+
     # Verificar si alguna de las llamadas falló
-    if not all(data.values()):
+    if not all(len(value) for value in data.values()):
         st.error("Fallo al obtener algunos de los datos de la API. La aplicación podría no funcionar correctamente.")
         return None
 
+    data['timings'] = {
+        'leads': leads_time,
+        **reference['timings'],
+        'catalogos': reference_time,  # casi cero cuando vienen de la caché
+        'total': time.perf_counter() - start,
+    }
+    data['latency_stats'] = api.get_latency_stats()
     return data
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# MÓDULO DE ÍNDICE DE LEADS
+# =============================================================================
+# Responsabilidad: Indexar el DataFrame maestro por día de creación (ordenado)
+# y por ejecutivo/estado, para que los filtros de rango de fechas se resuelvan
+# con búsqueda binaria en lugar de recorrer todo el histórico en cada rerun.
+# =============================================================================
+
+import numpy as np
+import streamlit as st
+
+from data_processor import dia_clave
+import lead_store
+
+# Columnas con posiciones secundarias precalculadas
+COLUMNAS_INDEXADAS = ['responsable_nombre', 'estado']
+
+class LeadIndex:
+    """
+    Índice de solo lectura sobre el DataFrame maestro. No guarda el DataFrame:
+    devuelve posiciones (iloc) que quien llama aplica a su propio DataFrame, que
+    debe ser de la misma versión que el usado para construir el índice.
+    """
+    def __init__(self, df):
+        dias = df['dia_creado'].to_numpy()
+        self.orden = np.argsort(dias, kind='stable')
+        self.dias_ordenados = dias[self.orden]
+        # Para cada columna, valor -> posiciones (ordenadas) de sus leads
+        self.posiciones = {}
+        for col in COLUMNAS_INDEXADAS:
+            codigos, valores = df[col].factorize()
+            orden_valor = np.argsort(codigos, kind='stable')
+            limites = np.searchsorted(codigos[orden_valor], np.arange(len(valores) + 1))
+            self.posiciones[col] = {
+                valor: orden_valor[limites[i]:limites[i + 1]] for i, valor in enumerate(valores)
+            }
+
+    def posiciones_rango(self, inicio, fin):
+        """Posiciones de los leads creados entre dos fechas (inclusive), vía búsqueda binaria."""
+        izq = np.searchsorted(self.dias_ordenados, dia_clave(inicio), side='left')
+        der = np.searchsorted(self.dias_ordenados, dia_clave(fin), side='right')
+        return self.orden[izq:der]
+
+    def _posiciones_valores(self, col, valores):
+        """Posiciones de los leads cuyo 'col' está en 'valores'; None si la selección no filtra nada."""
+        por_valor = self.posiciones[col]
+        seleccion = set(valores)
+        if seleccion.issuperset(por_valor):
+            return None
+        partes = [por_valor[v] for v in seleccion if v in por_valor]
+        return np.sort(np.concatenate(partes)) if partes else np.array([], dtype=np.intp)
+
+    def filtrar(self, inicio, fin, responsables=None, estados=None):
+        """
+        Posiciones (iloc, ascendentes) de los leads creados entre 'inicio' y 'fin'
+        (fechas locales, inclusive), opcionalmente restringidos a unos ejecutivos y
+        estados. Uso: df.iloc[indice.filtrar(...)].
+        """
+        posiciones = np.sort(self.posiciones_rango(inicio, fin))
+        for col, valores in (('responsable_nombre', responsables), ('estado', estados)):
+            if valores is None or len(posiciones) == 0:
+                continue
+            secundarias = self._posiciones_valores(col, valores)
+            if secundarias is not None:
+                posiciones = np.intersect1d(posiciones, secundarias, assume_unique=True)
+        return posiciones
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _indice_cacheado(_df, version):
+    return LeadIndex(_df)
+
+def obtener_indice(df):
+    """Índice del DataFrame, reutilizado entre reruns mientras los datos no cambien (ver version_datos)."""
+    return _indice_cacheado(df, lead_store.version_datos(df))
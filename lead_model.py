@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# MÓDULO DE MODELO DE LEAD SCORING
+# =============================================================================
+# Responsabilidad: Entrenar, fuera de la app, un modelo de probabilidad de
+# cierre sobre los leads ya cerrados, guardarlo en disco junto con su
+# codificador de variables y aplicarlo en lote a los leads activos.
+#
+# Entrenamiento: python lead_model.py
+# (usa el DataFrame procesado que la app guarda en disco; ver lead_store)
+# =============================================================================
+
+import os
+import sys
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from config import CONFIG
+from data_processor import CLIENTE_DESCONOCIDO
+import lead_store
+
+MODEL_VERSION = 2
+COLUMNAS_NUMERICAS = ['precio_log', 'edad_dias', 'cliente_tratos', 'cliente_ganados', 'cliente_win_rate']
+COLUMNAS_CATEGORICAS = ['responsable_nombre', 'pipeline_nombre']
+
+def _lista_tags(tags):
+    """Analizador del vectorizador de tags: cada lead ya trae su lista de etiquetas."""
+    return tags if isinstance(tags, list) else []
+
+def construir_features(leads, client_history=None):
+    """
+    Variables del modelo. Con 'client_history' (el del scoring) se usan sus conteos;
+    sin él, se calculan sobre los propios leads cerrados excluyendo a cada lead de
+    su historial (para entrenar sin que el lead se vea a sí mismo).
+    'edad_dias' son los días que el lead lleva abierto: hasta su cierre al entrenar
+    y hasta hoy al puntuar (predecir_probabilidad la acota al rango de entrenamiento).
+    """
+    conocido = leads['contacto_nombre'] != CLIENTE_DESCONOCIDO
+    if client_history is None:
+        ganado = (leads['estado'] == 'Ganado').astype(int)
+        por_cliente = ganado.groupby(leads['contacto_nombre'])
+        tratos = por_cliente.transform('count') - 1
+        ganados = por_cliente.transform('sum') - ganado
+        edad = leads['dias_para_cerrar'].fillna((leads['updated_at'] - leads['created_at']).dt.days)
+    else:
+        tratos = leads['contacto_nombre'].map(client_history['total_deals']).fillna(0)
+        ganados = leads['contacto_nombre'].map(client_history['deals_won']).fillna(0)
+        edad = (pd.Timestamp.now(tz='UTC') - leads['created_at']).dt.days
+    tratos, ganados = tratos.where(conocido, 0), ganados.where(conocido, 0)
+
+    return pd.DataFrame({
+        'precio_log': np.log1p(leads['price'].fillna(0).clip(lower=0)),
+        'edad_dias': edad.fillna(0).clip(lower=0),
+        'cliente_tratos': tratos,
+        'cliente_ganados': ganados,
+        'cliente_win_rate': (ganados / tratos.where(tratos > 0)).fillna(0),
+        'responsable_nombre': leads['responsable_nombre'].astype(str),
+        'pipeline_nombre': leads['pipeline_nombre'].astype(str),
+        'tags': leads['tags'],
+    }, index=leads.index)
+
+def crear_pipeline():
+    codificador = ColumnTransformer([
+        ('numericas', StandardScaler(), COLUMNAS_NUMERICAS),
+        ('categoricas', OneHotEncoder(handle_unknown='ignore'), COLUMNAS_CATEGORICAS),
+        ('tags', CountVectorizer(analyzer=_lista_tags, binary=True), 'tags'),
+    ])
+    return Pipeline([('codificador', codificador), ('modelo', LogisticRegression(max_iter=1000, class_weight='balanced'))])
+
+def entrenar(df, min_muestras=None):
+    """
+    Ajusta el modelo sobre los leads Ganados/Perdidos. Devuelve el artefacto
+    (pipeline + metadatos) o lanza ValueError si no hay datos suficientes.
+    """
+    min_muestras = min_muestras or CONFIG['scoring']['min_muestras_entrenamiento']
+    cerrados = df[df['estado'].isin(['Ganado', 'Perdido'])]
+    y = (cerrados['estado'] == 'Ganado').astype(int)
+    if len(cerrados) < min_muestras or y.nunique() < 2:
+        raise ValueError(f"Se necesitan al menos {min_muestras} leads cerrados, con ganados y perdidos (hay {len(cerrados)}).")
+
+    X = construir_features(cerrados)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=0, stratify=y)
+    pipeline = crear_pipeline().fit(X_train, y_train)
+    auc = roc_auc_score(y_test, pipeline.predict_proba(X_test)[:, 1])
+    # El modelo final se ajusta con todos los leads cerrados
+    pipeline = crear_pipeline().fit(X, y)
+    return {
+        'version': MODEL_VERSION,
+        'pipeline': pipeline,
+        'entrenado_en': int(time.time()),
+        'muestras': len(cerrados),
+        'auc_validacion': auc,
+        # Rango de 'edad_dias' visto al entrenar: los leads activos pueden llevar
+        # abiertos mucho más que lo que tardó en cerrarse cualquier lead
+        'rango_edad_dias': (float(X['edad_dias'].min()), float(X['edad_dias'].max())),
+    }
+
+def guardar_modelo(artefacto, path):
+    directorio = os.path.dirname(path)
+    if directorio and not os.path.exists(directorio):
+        os.makedirs(directorio)
+    tmp_path = f"{path}.tmp"
+    joblib.dump(artefacto, tmp_path)
+    os.replace(tmp_path, path)
+
+def cargar_modelo(path):
+    """Artefacto guardado por guardar_modelo, o None si no existe o es de otra versión."""
+    if not os.path.exists(path):
+        return None
+    try:
+        artefacto = joblib.load(path)
+    except Exception:
+        return None
+    if not isinstance(artefacto, dict) or artefacto.get('version') != MODEL_VERSION:
+        return None
+    return artefacto
+
+def predecir_probabilidad(artefacto, leads, client_history):
+    """Probabilidad de cierre de cada lead, en una sola llamada vectorizada a predict_proba."""
+    X = construir_features(leads, client_history)
+    X['edad_dias'] = X['edad_dias'].clip(*artefacto['rango_edad_dias'])
+    return pd.Series(artefacto['pipeline'].predict_proba(X)[:, 1], index=leads.index)
+
+def main():
+    path_frame = CONFIG['sync']['frame_path']
+    guardado = lead_store.cargar_frame(path_frame)
+    if guardado is None:
+        print(f"No hay datos procesados en '{path_frame}'. Abre la app una vez para generarlos.")
+        return 1
+    df, metadata = guardado
+    try:
+        artefacto = entrenar(df)
+    except ValueError as e:
+        print(f"No se entrenó el modelo: {e}")
+        return 1
+    guardar_modelo(artefacto, CONFIG['scoring']['modelo_path'])
+    print(f"Modelo entrenado con {artefacto['muestras']:,} leads cerrados "
+          f"(AUC de validación: {artefacto['auc_validacion']:.3f}) y guardado en '{CONFIG['scoring']['modelo_path']}'.")
+    return 0
+
+if __name__ == "__main__":
+    # Se ejecuta desde el módulo importado para que el artefacto referencie
+    # 'lead_model._lista_tags' y no '__main__._lista_tags'
+    import lead_model
+    sys.exit(lead_model.main())
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# MÓDULO DE ACTUALIZACIÓN EN SEGUNDO PLANO
+# =============================================================================
+# Responsabilidad: Mantener el DataFrame de leads al día con un hilo que
+# descarga y procesa los datos de Kommo mientras las páginas siguen usando
+# el último conjunto bueno (stale-while-revalidate). Al terminar, el nuevo
+# DataFrame reemplaza al anterior de una sola vez; si la descarga falla, se
+# sigue sirviendo el anterior.
+#
+# Con varios procesos de Streamlit sobre la misma carpeta de datos, solo uno
+# (el que tiene el bloqueo del archivo) descarga y publica el archivo Arrow;
+# todos, incluido él, sirven ese archivo con memory-map, así que las
+# columnas numéricas se comparten en memoria en lugar de copiarse.
+# =============================================================================
+
+import json
+import logging
+import os
+import threading
+import time
+import streamlit as st
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos, cada uno publica sus propios datos
+    fcntl = None
+
+from config import CONFIG
+from kommo_api import get_api_data, IncompletePaginationError
+from data_processor import procesar_datos
+import lead_store
+
+NOMBRE_HILO = 'refrescador-kommo'
+
+class _SinAvisoDeContexto(logging.Filter):
+    """
+    kommo_api llama a st.spinner/st.error; desde el hilo de fondo (y los pools que
+    abre, que heredan su nombre como prefijo) no hay sesión donde mostrarlos y
+    Streamlit lo avisaría en el log en cada actualización. Los demás hilos conservan el aviso.
+    """
+    def filter(self, record):
+        return not threading.current_thread().name.startswith(NOMBRE_HILO)
+
+logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').addFilter(_SinAvisoDeContexto())
+
+def _mensaje_error_api(error):
+    """Texto para el panel lateral a partir de la descarga incompleta y su causa."""
+    causa = error.cause
+    mensaje = f"No se pudo completar la descarga de '{error.endpoint}': {causa}"
+    if getattr(causa, 'status_code', None) == 401:
+        mensaje += " Error de autenticación (401). Verifica que tus 'secrets' en Streamlit Cloud sean correctos."
+    return mensaje
+
+# Lo que el publicador comparte con los demás procesos en el archivo de estado
+CAMPOS_ESTADO = ('duracion', 'error', 'aviso', 'ultimo_intento', 'actualizando', 'tiempos', 'latencias')
+
+class RefrescadorDatos:
+    """
+    Un hilo por proceso. El proceso publicador actualiza los datos cuando
+    caducan o cuando se pide; los demás solo vigilan el archivo publicado y
+    lo cargan cuando cambia. Al arrancar se sirve el archivo de disco aunque
+    esté caducado; solo el primer arranque sin archivo espera a la API.
+    """
+    def __init__(self, base_url, headers, frame_path=None):
+        self.base_url = base_url
+        self.headers = headers
+        self.frame_path = frame_path or CONFIG['sync']['frame_path']
+        self.path_bloqueo = f"{self.frame_path}.lock"
+        self.path_estado = f"{self.frame_path}.estado.json"
+        self.path_solicitud = f"{self.frame_path}.solicitud"
+        self.segundos_vigencia = CONFIG['sync']['minutos_refresco'] * 60
+        self.segundos_reintento = CONFIG['sync']['minutos_reintento'] * 60
+        self.segundos_sondeo = CONFIG['sync']['segundos_sondeo']
+
+        # (df, fetched_at): se reemplaza la tupla completa, así nadie ve un df con la hora de otro
+        self._datos = None
+        self._firma = None  # (inodo, mtime) del archivo que se está sirviendo
+        self.duracion = None  # segundos de la última actualización exitosa
+        self.error = None  # mensaje de la última actualización si falló
+        self.aviso = None  # problema no fatal (p. ej. no se pudo guardar en disco)
+        self.ultimo_intento = None
+        self.actualizando = False
+        self.tiempos = None  # segundos por endpoint y del procesamiento en la última descarga exitosa
+        self.latencias = None  # resumen de latencias por petición (KommoAPI.get_latency_stats)
+        self.leads_recibidos = 0
+
+        self._bloqueo = None  # archivo con el bloqueo mientras este proceso es el publicador
+        self._solicitada = False
+        self._despertar = threading.Event()
+        self._primer_intento = threading.Event()
+
+        self._adjuntar()
+        # Duración, tiempos y errores de la última descarga publicada (p. ej. antes de reiniciar la app)
+        self._leer_estado()
+        self.actualizando = False
+        self._hilo = threading.Thread(target=self._bucle, name=NOMBRE_HILO, daemon=True)
+        self._hilo.start()
+
+    @property
+    def df(self):
+        """Último DataFrame bueno, o None si todavía no hay ninguno."""
+        datos = self._datos
+        return datos[0] if datos else None
+
+    def edad(self):
+        """Segundos desde la descarga de los datos que se están sirviendo."""
+        datos = self._datos
+        return time.time() - datos[1] if datos else None
+
+    def esperar_primera_carga(self, timeout=None):
+        """Bloquea hasta que haya datos o falle el primer intento (solo importa si no había datos en disco)."""
+        return self._primer_intento.wait(timeout)
+
+    def usar_token(self, access_token):
+        """Usa un token nuevo en las siguientes descargas; si la última falló, reintenta enseguida."""
+        headers = {'Authorization': f"Bearer {access_token}"}
+        if headers != self.headers:
+            self.headers = headers
+            if self.error is not None:
+                self.solicitar_actualizacion()
+
+    def solicitar_actualizacion(self):
+        """Pide una actualización inmediata; los datos actuales se siguen sirviendo mientras tanto."""
+        self._solicitada = True
+        self._despertar.set()
+
+    def _vencido(self):
+        edad = self.edad()
+        return edad is None or edad >= self.segundos_vigencia
+
+    def _segundos_hasta_siguiente(self):
+        if self._bloqueo is None and fcntl is not None:
+            return self.segundos_sondeo
+        edad = self.edad()
+        if self.error is not None and self.ultimo_intento is not None:
+            espera = self.segundos_reintento - (time.time() - self.ultimo_intento)
+        elif edad is None:
+            espera = self.segundos_reintento
+        else:
+            espera = self.segundos_vigencia - edad
+        # El publicador también sondea, para atender las solicitudes de los demás procesos
+        return min(max(espera, 0), self.segundos_sondeo)
+
+    def _bucle(self):
+        while True:
+            try:
+                self._ciclo()
+                espera = self._segundos_hasta_siguiente()
+            except Exception as e:
+                # Un fallo inesperado no debe detener el hilo: se registra y se reintenta más tarde
+                self.error = f"{type(e).__name__}: {e}"
+                self._primer_intento.set()
+                espera = self.segundos_reintento
+            self._despertar.wait(espera)
+            self._despertar.clear()
+
+    def _ciclo(self):
+        self._adjuntar()
+        if self._es_publicador():
+            if self._solicitada or self._solicitud_externa() or self._debe_actualizar():
+                self._solicitada = False
+                self._actualizar()
+        else:
+            self._leer_estado()
+            if self._solicitada:
+                self._solicitada = False
+                self._publicar_solicitud()
+        if self._datos is not None or self.error is not None:
+            self._primer_intento.set()
+
+    def _debe_actualizar(self):
+        if (self.error is not None and self.ultimo_intento is not None
+                and time.time() - self.ultimo_intento < self.segundos_reintento):
+            return False
+        return self._vencido()
+
+    def _adjuntar(self):
+        """Pasa a servir el archivo publicado si cambió (memory-map, sin copiar las columnas numéricas)."""
+        try:
+            info = os.stat(self.frame_path)
+        except OSError:
+            return
+        firma = (info.st_ino, info.st_mtime_ns)
+        if firma == self._firma:
+            return
+        guardado = lead_store.cargar_frame(self.frame_path)
+        if guardado is not None:
+            df, metadata = guardado
+            self._datos = (df, metadata['fetched_at'])
+            self._firma = firma
+
+    def _es_publicador(self):
+        """Toma el bloqueo del archivo si nadie lo tiene; lo conserva mientras viva el proceso."""
+        if fcntl is None or self._bloqueo is not None:
+            return True
+        try:
+            directorio = os.path.dirname(self.path_bloqueo)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            archivo = open(self.path_bloqueo, 'a')
+        except OSError:
+            # Sin poder crear el bloqueo, el proceso se actualiza por su cuenta
+            return True
+        try:
+            fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            archivo.close()
+            return False
+        self._bloqueo = archivo
+        return True
+
+    def _solicitud_externa(self):
+        try:
+            pedida = os.stat(self.path_solicitud).st_mtime
+        except OSError:
+            return False
+        return self.ultimo_intento is None or pedida > self.ultimo_intento
+
+    def _publicar_solicitud(self):
+        try:
+            with open(self.path_solicitud, 'w') as f:
+                f.write(str(time.time()))
+        except OSError:
+            pass
+
+    def _escribir_estado(self):
+        if fcntl is None:
+            return
+        try:
+            tmp_path = f"{self.path_estado}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({campo: getattr(self, campo) for campo in CAMPOS_ESTADO}, f)
+            os.replace(tmp_path, self.path_estado)
+        except OSError:
+            pass
+
+    def _leer_estado(self):
+        try:
+            with open(self.path_estado) as f:
+                estado = json.load(f)
+        except (OSError, ValueError):
+            return
+        for campo in CAMPOS_ESTADO:
+            setattr(self, campo, estado.get(campo))
+
+    def _actualizar(self):
+        self.actualizando = True
+        self.leads_recibidos = 0
+        self.ultimo_intento = time.time()
+        self._escribir_estado()
+        inicio = time.perf_counter()
+        try:
+            fetched_at = time.time()
+            api_data = get_api_data(self.base_url, self.headers, progress=self._progreso)
+            if not api_data or len(api_data.get('leads', [])) == 0:
+                self.error = "No se obtuvieron datos de leads desde la API."
+                return
+            inicio_procesamiento = time.perf_counter()
+            df = procesar_datos(api_data)
+            tiempos = {**api_data['timings'], 'procesamiento': time.perf_counter() - inicio_procesamiento}
+            try:
+                lead_store.guardar_frame(self.frame_path, df, fetched_at)
+                self.aviso = None
+            except (OSError, ValueError) as e:
+                self.aviso = f"No se pudo guardar la caché local de leads: {e}"
+            self._adjuntar()
+            if self.aviso is not None:
+                # Sin archivo publicado, este proceso sirve su propia copia en memoria
+                df.attrs['fetched_at'] = int(fetched_at)
+                self._datos = (df, fetched_at)
+            self.duracion = time.perf_counter() - inicio
+            self.tiempos, self.latencias = tiempos, api_data['latency_stats']
+            self.error = None
+        except IncompletePaginationError as e:
+            self.error = _mensaje_error_api(e)
+        except Exception as e:
+            # El hilo no debe morir: se reintenta más tarde con los datos anteriores
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            self.actualizando = False
+            self._escribir_estado()
+
+    def _progreso(self, n):
+        self.leads_recibidos = n
+
+@st.cache_resource(show_spinner=False)
+def _refrescador_cacheado(subdomain, _access_token):
+    # El token no forma parte de la clave: al rotarlo se actualiza el refrescador existente,
+    # que conserva su hilo y el bloqueo de publicador
+    return RefrescadorDatos(
+        base_url=f"https://{subdomain}.kommo.com/api/v4",
+        headers={'Authorization': f"Bearer {_access_token}"},
+    )
+
+def obtener_refrescador(subdomain, access_token):
+    """Refrescador compartido por todas las sesiones del proceso (uno por cuenta de Kommo)."""
+    refrescador = _refrescador_cacheado(subdomain, access_token)
+    refrescador.usar_token(access_token)
+    return refrescador
+
+def mostrar_estado(refrescador):
+    """Antigüedad de los datos y duración de la última actualización en el panel lateral."""
+    edad = refrescador.edad()
+    if edad is not None:
+        texto = f"Datos de hace {int(edad // 60)} min"
+        if refrescador.duracion is not None:
+            texto += f" · última actualización: {refrescador.duracion:.1f} s"
+        if refrescador.actualizando:
+            texto += " · actualizando desde Kommo..."
+        st.sidebar.caption(texto)
+    if refrescador.tiempos:
+        with st.sidebar.expander("Detalle de la última descarga"):
+            st.caption(" · ".join(f"{paso}: {segundos:.2f} s" for paso, segundos in refrescador.tiempos.items()))
+            latencias = refrescador.latencias or {}
+            if latencias.get('peticiones'):
+                st.caption(f"{latencias['peticiones']} peticiones · espera promedio {latencias['ttfb_promedio']:.2f} s · "
+                           f"descarga promedio {latencias['descarga_promedio']:.2f} s · p50 {latencias['total_p50']:.2f} s · "
+                           f"máx. {latencias['total_max']:.2f} s · {latencias['bytes_totales'] / 1024 / 1024:.1f} MB")
+    if refrescador.aviso:
+        st.sidebar.caption(refrescador.aviso)
+    if refrescador.error and edad is not None:
+        st.sidebar.warning(f"La última actualización falló; se muestran los datos anteriores. ({refrescador.error})")
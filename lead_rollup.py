@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# MÓDULO DE CUBO DE AGREGADOS DIARIOS
+# =============================================================================
+# Responsabilidad: Preagregar los leads una vez por carga de datos por día
+# local de creación, ejecutivo, estado y pipeline para que los KPIs,
+# sparklines y gráficos de un periodo sumen unas cuantas filas en lugar de
+# recorrer todos los leads en cada rerun. Las ventas por día de cierre y la
+# salud de los leads activos van en agregados aparte, más pequeños, para no
+# multiplicar las filas del cubo principal.
+# =============================================================================
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from data_processor import dia_clave, fecha_de_clave, SIN_FECHA
+import lead_store
+
+DIMENSIONES_CUBO = ['dia_creado', 'responsable_nombre', 'estado', 'pipeline_nombre']
+MEDIDAS_CUBO = ['leads', 'ganados', 'perdidos', 'en_tramite', 'valor_ganado', 'ciclo_suma', 'ciclo_n']
+# Ventas ganadas por día de cierre (solo leads 'Ganado'; el día de creación sirve para filtrar el periodo)
+DIMENSIONES_CIERRES = ['dia_creado', 'dia_cerrado', 'responsable_nombre']
+MEDIDAS_CIERRES = ['ganados']
+# Salud de la cartera (solo leads 'En Trámite'; para el resto 'salud_lead' es 'N/A')
+DIMENSIONES_SALUD = ['dia_creado', 'responsable_nombre', 'salud_lead']
+
+def _kpis(totales):
+    total_leads = int(totales['leads'])
+    ganados = int(totales['ganados'])
+    return {
+        'total_leads': total_leads,
+        'ventas_ganadas': ganados,
+        'tasa_conversion': (ganados / total_leads * 100) if total_leads > 0 else 0,
+        'valor_ganado': totales['valor_ganado'],
+        'ciclo_promedio': totales['ciclo_suma'] / totales['ciclo_n'] if totales['ciclo_n'] > 0 else float('nan'),
+        'perdidos': int(totales['perdidos']),
+        'en_tramite': int(totales['en_tramite']),
+    }
+
+class CuboLeads:
+    """
+    Agregados por día de creación, ejecutivo, estado y pipeline. 'ciclo_suma' y
+    'ciclo_n' acumulan 'dias_para_cerrar' de las ventas ganadas para poder
+    promediarlo después de sumar. 'cierres' y 'salud' son los agregados aparte
+    de ventas por día de cierre y de salud de los leads en trámite.
+    """
+    def __init__(self, tabla, cierres, salud):
+        self.tabla = tabla
+        self.cierres = cierres
+        self.salud = salud
+
+    @classmethod
+    def desde_leads(cls, df):
+        ganado = df['estado'] == 'Ganado'
+        en_tramite = df['estado'] == 'En Trámite'
+        ciclo = df['dias_para_cerrar'].astype('float64').where(ganado)
+        # Todas las medidas en float64: un único bloque que se suma con una sola operación
+        medidas = pd.DataFrame({
+            'leads': 1.0,
+            'ganados': ganado.astype('float64'),
+            'perdidos': (df['estado'] == 'Perdido').astype('float64'),
+            'en_tramite': en_tramite.astype('float64'),
+            'valor_ganado': df['price'].where(ganado, 0).astype('float64'),
+            'ciclo_suma': ciclo.fillna(0),
+            'ciclo_n': ciclo.notna().astype('float64'),
+        }, index=df.index)
+        for dim in dict.fromkeys(DIMENSIONES_CUBO + DIMENSIONES_CIERRES + DIMENSIONES_SALUD):
+            medidas[dim] = df[dim]
+
+        def agregar(filas, dimensiones, columnas):
+            # Ordenado (primero por 'dia_creado') para filtrar periodos con búsqueda binaria
+            tabla = filas.groupby(dimensiones, observed=True, dropna=False, sort=True)[columnas].sum()
+            return tabla.reset_index()
+
+        return cls(
+            agregar(medidas, DIMENSIONES_CUBO, MEDIDAS_CUBO),
+            agregar(medidas[ganado.to_numpy()], DIMENSIONES_CIERRES, MEDIDAS_CIERRES),
+            agregar(medidas[en_tramite.to_numpy()], DIMENSIONES_SALUD, ['leads']),
+        )
+
+    def __len__(self):
+        return len(self.tabla)
+
+    def filtrar(self, inicio, fin, responsables=None, estados=None):
+        """Sub-cubo de los leads creados entre 'inicio' y 'fin' (inclusive), con ejecutivos y estados opcionales."""
+        def recortar(t, estado=None):
+            if estados is not None and estado is not None and estado not in estados:
+                return t.iloc[:0]
+            dias = t['dia_creado'].to_numpy()
+            t = t.iloc[np.searchsorted(dias, dia_clave(inicio), side='left'):np.searchsorted(dias, dia_clave(fin), side='right')]
+            mascara = np.ones(len(t), dtype=bool)
+            if responsables is not None:
+                mascara &= _en(t['responsable_nombre'], responsables)
+            if estados is not None and estado is None:
+                mascara &= _en(t['estado'], estados)
+            return t if mascara.all() else t.iloc[np.flatnonzero(mascara)]
+
+        return CuboLeads(recortar(self.tabla), recortar(self.cierres, 'Ganado'), recortar(self.salud, 'En Trámite'))
+
+    def kpis(self):
+        """KPIs del periodo con las mismas definiciones que el cálculo sobre leads."""
+        return _kpis(dict(zip(MEDIDAS_CUBO, self.tabla[MEDIDAS_CUBO].to_numpy().sum(axis=0))))
+
+    def kpis_por(self, dimension):
+        """KPIs por cada valor de una dimensión (p. ej. por ejecutivo) con una sola agregación."""
+        totales = self.tabla.groupby(dimension, observed=True)[MEDIDAS_CUBO].sum()
+        return {valor: _kpis(fila) for valor, fila in totales[totales['leads'] > 0].iterrows()}
+
+    def conteos(self, dimensiones, medida='leads'):
+        """Suma de una medida por una o varias dimensiones, sin combinaciones vacías."""
+        serie = self.tabla.groupby(dimensiones, observed=True)[medida].sum()
+        return serie[serie > 0]
+
+    def conteos_salud(self):
+        """Leads en trámite por salud ('Saludable', 'En Riesgo', 'Crítico'), sin ceros."""
+        serie = self.salud.groupby('salud_lead', observed=True)['leads'].sum()
+        return serie[serie > 0]
+
+    def serie_diaria(self, medida='leads'):
+        """Serie diaria por día de creación de una medida del cubo principal."""
+        return _serie_diaria(self.tabla, 'dia_creado', medida)
+
+    def serie_ganados_por_cierre(self):
+        """Ventas ganadas por día de cierre (las ganadas sin fecha de cierre no cuentan)."""
+        return _serie_diaria(self.cierres, 'dia_cerrado', 'ganados')
+
+def _en(columna, valores):
+    """Máscara de pertenencia comparando códigos de la categoría en lugar de valores."""
+    codigos = columna.cat.categories.get_indexer(list(valores))
+    return np.isin(columna.cat.codes.to_numpy(), codigos[codigos >= 0])
+
+def _serie_diaria(tabla, dia_col, medida):
+    """Serie diaria (días sin actividad en cero) entre el primer y el último día con valor."""
+    t = tabla[(tabla[dia_col] != SIN_FECHA) & (tabla[medida] > 0)]
+    if t.empty:
+        return pd.Series(dtype='int64')
+    por_dia = t.groupby(dia_col)[medida].sum()
+    dias = range(por_dia.index.min(), por_dia.index.max() + 1)
+    por_dia = por_dia.reindex(dias, fill_value=0)
+    por_dia.index = pd.to_datetime([fecha_de_clave(d) for d in por_dia.index])
+    return por_dia
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _cubo_cacheado(_df, version):
+    return CuboLeads.desde_leads(_df)
+
+def obtener_cubo(df):
+    """Cubo del DataFrame maestro, construido una vez por versión de los datos."""
+    return _cubo_cacheado(df, lead_store.version_datos(df))
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# MÓDULO DE LEAD SCORING
+# =============================================================================
+# Responsabilidad: Puntuar los leads activos con reglas de negocio (historial
+# del cliente, valor y tasa de éxito del servicio) usando operaciones por
+# columna, y redactar el desglose de la puntuación solo cuando se pide.
+# =============================================================================
+
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from data_processor import CLIENTE_DESCONOCIDO
+from lead_tags import aplanar_tags
+import lead_store
+
+# Puntos por factor. Umbrales de valor: (mínimo exclusivo, puntos)
+PUNTOS_CLIENTE_RECURRENTE = 25
+PUNTOS_CLIENTE_CONOCIDO = 10
+UMBRALES_VALOR = [(20000, 20), (5000, 10)]
+# Tasa de éxito histórica del mejor servicio del lead: (mínimo exclusivo, puntos)
+UMBRALES_SERVICIO = [(0.75, 25), (0.50, 15), (0.25, 5)]
+
+ESTADOS_CERRADOS = ['Ganado', 'Perdido']
+
+def _contribuciones(cerrados):
+    """Lo que aporta cada lead cerrado al historial, indexado por id del lead."""
+    return pd.DataFrame({
+        'contacto_nombre': cerrados['contacto_nombre'].to_numpy(),
+        'tags': cerrados['tags'].to_numpy(),
+        'ganado': (cerrados['estado'] == 'Ganado').to_numpy(),
+    }, index=pd.Index(cerrados['id'].to_numpy(), name='id'))
+
+def _conteos(contribuciones):
+    """Conteos (total, ganados) por cliente y por servicio de un bloque de contribuciones."""
+    clientes = contribuciones.groupby('contacto_nombre')['ganado'].agg(total_deals='count', deals_won='sum')
+    clientes.index.name = 'nombre_cliente'
+    posiciones, etiquetas = aplanar_tags(contribuciones['tags'])
+    codigos, tags = pd.factorize(etiquetas)
+    servicios = pd.DataFrame({
+        'total_requests': np.bincount(codigos, minlength=len(tags)),
+        'requests_won': np.bincount(codigos, weights=contribuciones['ganado'].to_numpy()[posiciones], minlength=len(tags)).astype('int64'),
+    }, index=pd.Index(tags, name='tags'))
+    return clientes, servicios
+
+def _con_win_rate(conteos):
+    total, ganados = conteos.columns[:2]
+    conteos = conteos[conteos[total] > 0].astype('int64')
+    conteos['win_rate'] = conteos[ganados] / conteos[total]
+    return conteos
+
+class HistorialScoring:
+    """
+    Historial de clientes y servicios que se mantiene de forma incremental: en cada
+    versión nueva de los datos solo se procesan los leads con 'updated_at' posterior
+    a la última versión vista, restando lo que aportaban antes y sumando lo que
+    aportan ahora. Si el número de leads no cuadra (p. ej. leads eliminados tras una
+    resincronización completa) se reconstruye desde cero.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.high_water_mark = None
+        self.total_leads = 0
+        self.contribuciones = None
+        self.client_history = None
+        self.tag_history = None
+
+    def reconstruir(self, df):
+        self.contribuciones = _contribuciones(df[df['estado'].isin(ESTADOS_CERRADOS)])
+        clientes, servicios = _conteos(self.contribuciones)
+        self.client_history, self.tag_history = _con_win_rate(clientes), _con_win_rate(servicios)
+        self._marcar(df)
+
+    def _marcar(self, df):
+        self.high_water_mark = df['updated_at'].max()
+        self.total_leads = len(df)
+
+    def actualizar(self, df):
+        if self.high_water_mark is None:
+            return self.reconstruir(df)
+        cambios = df[df['updated_at'] > self.high_water_mark]
+        nuevos = int((cambios['created_at'] > self.high_water_mark).sum())
+        if len(df) != self.total_leads + nuevos:
+            return self.reconstruir(df)
+        if cambios.empty:
+            return self._marcar(df)
+
+        salientes = self.contribuciones.loc[self.contribuciones.index.intersection(cambios['id'])]
+        entrantes = _contribuciones(cambios[cambios['estado'].isin(ESTADOS_CERRADOS)])
+        clientes_out, servicios_out = _conteos(salientes)
+        clientes_in, servicios_in = _conteos(entrantes)
+        self.client_history = _con_win_rate(
+            self.client_history.drop(columns='win_rate').sub(clientes_out, fill_value=0).add(clientes_in, fill_value=0))
+        self.tag_history = _con_win_rate(
+            self.tag_history.drop(columns='win_rate').sub(servicios_out, fill_value=0).add(servicios_in, fill_value=0))
+        self.contribuciones = pd.concat([self.contribuciones.drop(salientes.index), entrantes])
+        self._marcar(df)
+
+    def tablas(self, df):
+        """(client_history, tag_history) al día con 'df', actualizando solo si cambió su versión."""
+        version = lead_store.version_datos(df)
+        with self.lock:
+            if version != self.version:
+                self.actualizar(df)
+                self.version = version
+            return self.client_history, self.tag_history
+
+@st.cache_resource(show_spinner=False)
+def _historial_compartido():
+    return HistorialScoring()
+
+def obtener_historial(df):
+    """Historial de scoring compartido por todas las sesiones del proceso."""
+    return _historial_compartido().tablas(df)
+
+def _puntos_por_umbral(valores, umbrales):
+    condiciones = [valores > minimo for minimo, _ in umbrales]
+    return np.select(condiciones, [puntos for _, puntos in umbrales], default=0)
+
+def _mejor_servicio(leads, tag_history):
+    """
+    Por lead, el tag con mayor tasa de éxito histórica (> 0). En empate gana el
+    primero en la lista de tags del lead.
+    """
+    posiciones, etiquetas = aplanar_tags(leads['tags'])
+    inicio_lead = np.searchsorted(posiciones, posiciones, side='left')
+    candidatos = pd.DataFrame({
+        'lead': leads.index[posiciones],
+        'orden': np.arange(len(posiciones)) - inicio_lead,
+        'tag': etiquetas,
+        'win_rate': pd.Series(etiquetas, dtype=object).map(tag_history['win_rate']).to_numpy(),
+    })
+    candidatos = candidatos[candidatos['win_rate'] > 0]
+    mejores = candidatos.sort_values(['lead', 'win_rate', 'orden'], ascending=[True, False, True]) \
+        .drop_duplicates('lead').set_index('lead')
+    return mejores['tag'].reindex(leads.index), mejores['win_rate'].reindex(leads.index).fillna(0)
+
+def calcular_puntuaciones(leads, client_history, tag_history):
+    """
+    Puntuación bruta de cada lead y los datos por factor necesarios para explicarla
+    (ver explicar_puntuacion). Devuelve un DataFrame con el mismo índice que 'leads',
+    que debe ser único.
+    """
+    # Factor 1: Historial del Cliente
+    ventas_cliente = leads['contacto_nombre'].map(client_history['deals_won'])
+    conocido = ventas_cliente.notna() & (leads['contacto_nombre'] != CLIENTE_DESCONOCIDO)
+    puntos_cliente = np.where(conocido, np.where(ventas_cliente > 0, PUNTOS_CLIENTE_RECURRENTE, PUNTOS_CLIENTE_CONOCIDO), 0)
+
+    # Factor 2: Valor del Lead (Price)
+    puntos_valor = _puntos_por_umbral(leads['price'], UMBRALES_VALOR)
+
+    # Factor 3: Tipo de Servicio (Tags)
+    mejor_tag, mejor_win_rate = _mejor_servicio(leads, tag_history)
+    puntos_servicio = _puntos_por_umbral(mejor_win_rate, UMBRALES_SERVICIO)
+
+    return pd.DataFrame({
+        'raw_score': puntos_cliente + puntos_valor + puntos_servicio,
+        'puntos_cliente': puntos_cliente,
+        'ventas_cliente': ventas_cliente.where(conocido),
+        'puntos_valor': puntos_valor,
+        'puntos_servicio': puntos_servicio,
+        'mejor_tag': mejor_tag,
+        'mejor_tag_win_rate': mejor_win_rate,
+    }, index=leads.index)
+
+def explicar_puntuacion(lead):
+    """Desglose legible de la puntuación de un lead (una fila con las columnas de calcular_puntuaciones)."""
+    reasons = []
+    if lead['puntos_cliente'] == PUNTOS_CLIENTE_RECURRENTE:
+        reasons.append(f"+{PUNTOS_CLIENTE_RECURRENTE} pts: Cliente recurrente con {int(lead['ventas_cliente'])} venta(s) previa(s).")
+    elif lead['puntos_cliente'] == PUNTOS_CLIENTE_CONOCIDO:
+        reasons.append(f"+{PUNTOS_CLIENTE_CONOCIDO} pts: Cliente conocido, pero sin ventas previas.")
+    else:
+        reasons.append("+0 pts: Cliente nuevo.")
+
+    price = lead['price']
+    if lead['puntos_valor'] == UMBRALES_VALOR[0][1]:
+        reasons.append(f"+{lead['puntos_valor']} pts: Valor alto (${price:,.0f}).")
+    elif lead['puntos_valor'] > 0:
+        reasons.append(f"+{lead['puntos_valor']} pts: Valor medio (${price:,.0f}).")
+    else:
+        reasons.append(f"+0 pts: Valor bajo (${price:,.0f}).")
+
+    if lead['puntos_servicio'] > 0:
+        reasons.append(f"+{lead['puntos_servicio']} pts: El servicio '{lead['mejor_tag']}' tiene una tasa de éxito histórica del {lead['mejor_tag_win_rate']:.0%}.")
+    return reasons
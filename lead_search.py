@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# MÓDULO DE BÚSQUEDA DE LEADS
+# =============================================================================
+# Responsabilidad: Indexar una vez por carga de datos el nombre del lead, el
+# nombre del contacto y el folio (id) de cada lead, sin acentos ni mayúsculas,
+# para que el buscador responda con un índice de trigramas en lugar de
+# recorrer todos los nombres en cada rerun, y resolver folios exactos.
+# =============================================================================
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from data_processor import plegar_texto
+import lead_store
+
+# Separa los campos de un lead en el texto indexado (ninguna búsqueda lo contiene)
+SEPARADOR = '\x1f'
+LARGO_NGRAMA = 3
+
+class IndiceBusqueda:
+    """
+    Índice de subcadenas sobre 'name', 'contacto_nombre' e 'id'. Cada trigrama del
+    texto plegado apunta a los leads que lo contienen; una búsqueda interseca las
+    listas de sus trigramas y confirma la subcadena solo en esos candidatos.
+    """
+    def __init__(self, df):
+        self.ids = df['id'].to_numpy(dtype=np.int64)
+        self.orden_ids = np.argsort(self.ids, kind='stable')
+        self.ids_ordenados = self.ids[self.orden_ids]
+
+        nombres = _plegar_columna(df['name'])
+        contactos = _plegar_columna(df['contacto_nombre'])
+        self.textos = [f"{n}{SEPARADOR}{c}{SEPARADOR}{i}" for n, c, i in zip(nombres, contactos, self.ids)]
+        self._indexar_trigramas()
+
+    def _indexar_trigramas(self):
+        """Listas de posiciones por trigrama, calculadas con arreglos (sin bucle por lead)."""
+        texto = ''.join(t + SEPARADOR for t in self.textos)
+        codigos = np.frombuffer(texto.encode('utf-32-le'), dtype=np.uint32)
+        # Alfabeto compacto: cada carácter distinto pasa a un entero pequeño
+        self.alfabeto, letras = np.unique(codigos, return_inverse=True)
+        letras = letras.astype(np.int64)
+        base = len(self.alfabeto)
+        largos = np.fromiter((len(t) + 1 for t in self.textos), dtype=np.int64, count=len(self.textos))
+        documento = np.repeat(np.arange(len(self.textos)), largos)
+
+        separador = np.searchsorted(self.alfabeto, ord(SEPARADOR))
+        n = len(letras) - LARGO_NGRAMA + 1
+        if n <= 0:
+            self.claves, self.limites, self.posiciones = np.array([], dtype=np.int64), np.array([0]), np.array([], dtype=np.int64)
+            return
+        gramas = np.zeros(n, dtype=np.int64)
+        validos = np.ones(n, dtype=bool)
+        for k in range(LARGO_NGRAMA):
+            gramas = gramas * base + letras[k:k + n]
+            validos &= letras[k:k + n] != separador
+
+        gramas, documento = gramas[validos], documento[:n][validos]
+        # Orden por (trigrama, lead) y sin repetir un mismo trigrama dentro del lead
+        orden = np.lexsort((documento, gramas))
+        gramas, documento = gramas[orden], documento[orden]
+        distintos = np.ones(len(gramas), dtype=bool)
+        distintos[1:] = (gramas[1:] != gramas[:-1]) | (documento[1:] != documento[:-1])
+        gramas, self.posiciones = gramas[distintos], documento[distintos]
+        self.claves, inicio = np.unique(gramas, return_index=True)
+        self.limites = np.append(inicio, len(gramas))
+
+    def __len__(self):
+        return len(self.textos)
+
+    def _gramas_consulta(self, consulta):
+        """Códigos de los trigramas de la consulta, o None si tiene caracteres que no aparecen en el índice."""
+        codigos = np.array([ord(c) for c in consulta], dtype=np.uint32)
+        letras = np.searchsorted(self.alfabeto, codigos)
+        if (letras >= len(self.alfabeto)).any() or (self.alfabeto[np.minimum(letras, len(self.alfabeto) - 1)] != codigos).any():
+            return None
+        base = len(self.alfabeto)
+        n = len(letras) - LARGO_NGRAMA + 1
+        gramas = np.zeros(n, dtype=np.int64)
+        for k in range(LARGO_NGRAMA):
+            gramas = gramas * base + letras[k:k + n]
+        return np.unique(gramas)
+
+    def buscar_posiciones(self, consulta):
+        """Posiciones (iloc, ascendentes) de los leads cuyo nombre, contacto o folio contienen 'consulta'."""
+        consulta = plegar_texto(consulta.strip())
+        if not consulta or SEPARADOR in consulta:
+            return np.array([], dtype=np.int64)
+        if len(consulta) < LARGO_NGRAMA:
+            # Consultas de 1-2 caracteres: no hay trigramas, se recorren los textos ya plegados
+            return np.array([i for i, t in enumerate(self.textos) if consulta in t], dtype=np.int64)
+
+        gramas = self._gramas_consulta(consulta)
+        if gramas is None:
+            return np.array([], dtype=np.int64)
+        j = np.searchsorted(self.claves, gramas)
+        if (j >= len(self.claves)).any() or (self.claves[np.minimum(j, len(self.claves) - 1)] != gramas).any():
+            return np.array([], dtype=np.int64)
+        # Se interseca empezando por el trigrama con menos leads
+        listas = sorted((self.posiciones[self.limites[i]:self.limites[i + 1]] for i in j), key=len)
+        candidatos = listas[0]
+        for lista in listas[1:]:
+            if len(candidatos) == 0:
+                break
+            candidatos = np.intersect1d(candidatos, lista, assume_unique=True)
+        # Los trigramas pueden coincidir en desorden: se confirma la subcadena en los candidatos
+        return np.array([i for i in candidatos if consulta in self.textos[i]], dtype=np.int64)
+
+    def buscar(self, consulta):
+        """Ids de los leads que coinciden con 'consulta' (ver buscar_posiciones)."""
+        return self.ids[self.buscar_posiciones(consulta)]
+
+    def posicion_folio(self, folio):
+        """Posición (iloc) del lead con ese id exacto, o None."""
+        try:
+            folio = int(str(folio).strip().lstrip('#'))
+        except ValueError:
+            return None
+        i = np.searchsorted(self.ids_ordenados, folio)
+        if i < len(self.ids_ordenados) and self.ids_ordenados[i] == folio:
+            return int(self.orden_ids[i])
+        return None
+
+def _plegar_columna(serie):
+    """Pliega cada valor distinto una sola vez (los contactos se repiten mucho)."""
+    valores = serie.astype(object).where(serie.notna(), '')
+    distintos = pd.unique(valores)
+    plegados = {v: plegar_texto(str(v)) for v in distintos}
+    return [plegados[v] for v in valores]
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _indice_cacheado(_df, version):
+    return IndiceBusqueda(_df)
+
+def obtener_indice_busqueda(df):
+    """Índice de búsqueda del DataFrame maestro, construido una vez por versión de los datos."""
+    return _indice_cacheado(df, lead_store.version_datos(df))
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# MÓDULO DE ALMACENAMIENTO LOCAL DE LEADS
+# =============================================================================
+# Responsabilidad: Persistir en disco la última descarga exitosa de leads
+# para que las recargas solo pidan a la API lo que cambió desde entonces,
+# y el DataFrame ya procesado para arrancar sin esperar a la API.
+# =============================================================================
+
+import json
+import os
+import pickle
+import time
+import pandas as pd
+import pyarrow as pa
+
+SNAPSHOT_VERSION = 2
+# Subir cuando cambien las columnas o tipos que produce procesar_datos
+FRAME_SCHEMA_VERSION = 3
+FRAME_METADATA_KEY = b'kommo_ventas'
+
+def cargar_snapshot(path):
+    """Lee el snapshot de leads guardado en disco. Devuelve None si no existe o es inválido."""
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = pd.read_pickle(path, compression='gzip')
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+def guardar_snapshot(path, leads, full_sync_at):
+    """Escribe el snapshot de forma atómica para no dejar archivos a medias."""
+    directorio = os.path.dirname(path)
+    if directorio and not os.path.exists(directorio):
+        os.makedirs(directorio)
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'high_water_mark': calcular_high_water_mark(leads),
+        'full_sync_at': full_sync_at,
+        'saved_at': int(time.time()),
+        'leads': leads,
+    }
+    tmp_path = f"{path}.tmp"
+    pd.to_pickle(snapshot, tmp_path, compression='gzip')
+    os.replace(tmp_path, path)
+    return snapshot
+
+def calcular_high_water_mark(leads):
+    """Mayor 'updated_at' (timestamp Unix) del DataFrame de leads."""
+    if leads.empty:
+        return 0
+    return int(leads['updated_at'].max())
+
+def fusionar_leads(existentes, nuevos):
+    """Combina los leads por 'id'; la versión nueva de un lead reemplaza a la guardada."""
+    combinados = pd.concat([existentes, nuevos], ignore_index=True)
+    return combinados.drop_duplicates(subset='id', keep='last').reset_index(drop=True)
+
+def guardar_frame(path, df, fetched_at=None):
+    """
+    Guarda el DataFrame procesado como archivo Arrow IPC (Feather v2) sin comprimir,
+    para poder leerlo con memory-map. La cabecera del esquema lleva la hora de la
+    descarga, el 'high water mark' y la versión del esquema.
+    """
+    directorio = os.path.dirname(path)
+    if directorio and not os.path.exists(directorio):
+        os.makedirs(directorio)
+    metadata = {
+        'schema_version': FRAME_SCHEMA_VERSION,
+        'fetched_at': int(fetched_at or time.time()),
+        'high_water_mark': int(df['updated_at'].max().timestamp()) if not df.empty else 0,
+        'filas': len(df),
+    }
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, FRAME_METADATA_KEY: json.dumps(metadata).encode()})
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+    return metadata
+
+def leer_metadata_frame(path):
+    """Lee solo la cabecera del archivo Arrow, sin cargar las columnas."""
+    try:
+        with pa.memory_map(path) as source:
+            schema = pa.ipc.open_file(source).schema
+    except (OSError, pa.ArrowInvalid):
+        return None
+    raw = (schema.metadata or {}).get(FRAME_METADATA_KEY)
+    metadata = json.loads(raw) if raw else None
+    if not metadata or metadata.get('schema_version') != FRAME_SCHEMA_VERSION:
+        return None
+    return metadata
+
+def cargar_frame(path):
+    """
+    Carga el DataFrame procesado desde disco mediante memory-map. Devuelve
+    (df, metadata), o None si el archivo no existe o es de otra versión del
+    esquema. La antigüedad no se comprueba aquí: el refrescador sirve a propósito
+    archivos caducados mientras descarga los nuevos.
+
+    Las columnas numéricas, de fechas y los códigos de las categóricas sin
+    nulos quedan como vistas de solo lectura sobre el archivo: los procesos
+    que cargan el mismo archivo comparten esas páginas en lugar de copiarlas.
+    """
+    if not os.path.exists(path):
+        return None
+    metadata = leer_metadata_frame(path)
+    if metadata is None:
+        return None
+    try:
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+            # Las columnas de listas (p. ej. 'tags') se devuelven como listas de Python,
+            # igual que las produce procesar_datos, y no como arrays de numpy
+            columnas_lista = [f.name for f in table.schema if pa.types.is_list(f.type)]
+            # split_blocks evita consolidar (copiar) las columnas en bloques de pandas
+            df = table.drop_columns(columnas_lista).to_pandas(split_blocks=True)
+            # insert, y no df[columnas], para no copiar el resto al reordenar
+            for col in columnas_lista:
+                df.insert(table.column_names.index(col), col, table.column(col).to_pylist())
+            # Identifica la descarga para version_datos
+            df.attrs['fetched_at'] = metadata['fetched_at']
+    except (OSError, pa.ArrowInvalid):
+        return None
+    return df, metadata
+
+def version_datos(df):
+    """
+    Huella barata del frame para saber si cambió: filas, último 'updated_at' y la
+    hora de la descarga (df.attrs['fetched_at']). Sin esta última, una descarga
+    con los mismos leads y el mismo 'updated_at' máximo reutilizaría índices
+    construidos con columnas ya desactualizadas (p. ej. 'dias_sin_actualizar').
+    """
+    if df is None or df.empty:
+        return (0, None, None)
+    return (len(df), df['updated_at'].max(), df.attrs.get('fetched_at'))
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# MÓDULO DE ÍNDICE DE ETIQUETAS
+# =============================================================================
+# Responsabilidad: Guardar la relación lead -> etiqueta como dos arreglos de
+# enteros (id del lead, código de etiqueta) más el diccionario de etiquetas,
+# construidos una vez por carga de datos, para contar etiquetas bajo cualquier
+# filtro con un bincount en lugar de hacer explode('tags') del DataFrame.
+# =============================================================================
+
+import itertools
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import lead_store
+
+def aplanar_tags(tags):
+    """
+    Aplana una columna de listas de etiquetas. Devuelve (posiciones, etiquetas):
+    por cada etiqueta, la posición (0..n-1) de su lead en 'tags' y la etiqueta,
+    conservando el orden de las etiquetas dentro de cada lead.
+    """
+    listas = [t if isinstance(t, list) else [] for t in tags]
+    longitudes = np.fromiter((len(t) for t in listas), dtype=np.int64, count=len(listas))
+    posiciones = np.repeat(np.arange(len(listas)), longitudes)
+    etiquetas = np.array(list(itertools.chain.from_iterable(listas)), dtype=object)
+    return posiciones, etiquetas
+
+class IndiceTags:
+    """
+    Pares (lead, etiqueta) ordenados por id de lead. Los filtros se expresan con
+    los ids de los leads seleccionados, así que sirve para cualquier subconjunto
+    del DataFrame del que se construyó.
+    """
+    def __init__(self, df):
+        posiciones, etiquetas = aplanar_tags(df['tags'])
+        codigos, self.tags = pd.factorize(etiquetas)
+        ids = df['id'].to_numpy(dtype=np.int64)[posiciones]
+        orden = np.argsort(ids, kind='stable')
+        self.lead_ids = ids[orden]
+        self.tag_ids = codigos[orden].astype(np.int32)
+
+    def __len__(self):
+        return len(self.lead_ids)
+
+    def _mascara(self, ids):
+        """Pares que pertenecen a los leads 'ids', con una búsqueda binaria por lead."""
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        inicio = np.searchsorted(self.lead_ids, ids, side='left')
+        fin = np.searchsorted(self.lead_ids, ids, side='right')
+        con_tags = inicio < fin
+        # Rangos disjuntos: +1 donde empieza cada uno y -1 donde termina
+        delta = np.zeros(len(self.lead_ids) + 1, dtype=np.int32)
+        delta[inicio[con_tags]] += 1
+        delta[fin[con_tags]] -= 1
+        return np.cumsum(delta[:-1]) > 0
+
+    def conteos(self, ids=None):
+        """Leads por etiqueta (de mayor a menor, sin ceros), opcionalmente solo entre los leads 'ids'."""
+        tag_ids = self.tag_ids if ids is None else self.tag_ids[self._mascara(ids)]
+        conteos = pd.Series(np.bincount(tag_ids, minlength=len(self.tags)), index=self.tags, name='count')
+        return conteos[conteos > 0].sort_values(ascending=False, kind='stable')
+
+    def conteos_por(self, ids, grupos):
+        """
+        Leads por (grupo, etiqueta), sin ceros, donde 'grupos' da el grupo de cada
+        lead de 'ids' (p. ej. su ejecutivo). Un solo bincount para todos los grupos.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        codigos_grupo, valores_grupo = pd.factorize(pd.Series(grupos).astype(object))
+        mascara = self._mascara(ids)
+        orden = np.argsort(ids, kind='stable')
+        grupo_par = codigos_grupo[orden][np.searchsorted(ids[orden], self.lead_ids[mascara])]
+        n_tags = len(self.tags)
+        conteos = np.bincount(grupo_par * n_tags + self.tag_ids[mascara], minlength=len(valores_grupo) * n_tags)
+        indice = pd.MultiIndex.from_product([valores_grupo, self.tags])
+        serie = pd.Series(conteos, index=indice, name='count')
+        return serie[serie > 0]
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _indice_cacheado(_df, version):
+    return IndiceTags(_df)
+
+def obtener_indice_tags(df):
+    """Índice de etiquetas del DataFrame maestro, construido una vez por versión de los datos."""
+    return _indice_cacheado(df, lead_store.version_datos(df))
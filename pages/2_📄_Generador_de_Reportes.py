@@ -4,10 +4,14 @@ import streamlit as st
 from datetime import datetime, timedelta
 import pandas as pd
 import os
+import zipfile
 # Asegúrate de que las funciones importadas sean las correctas
 from pdf_generator import ReportGenerator, enviar_correo 
+import visualizations as viz
 # Asumimos que app.py tiene la función de carga de datos
 from PaginaPrincipal import cargar_y_procesar_datos 
+from lead_index import obtener_indice
+from lead_rollup import obtener_cubo
 
 # --- Configuración de la Página ---
 st.set_page_config(
@@ -56,6 +60,10 @@ df_master = cargar_y_procesar_datos()
 
 if df_master is not None and not df_master.empty:
     reporter = ReportGenerator(df_master)
+    # Los gráficos del PDF se dibujan en procesos aparte; se arrancan mientras se elige el reporte
+    viz.preparar_procesos()
+    indice = obtener_indice(df_master)
+    cubo = obtener_cubo(df_master)
 
     if 'generated_file_reports' not in st.session_state:
         st.session_state.generated_file_reports = None
@@ -98,19 +106,28 @@ if df_master is not None and not df_master.empty:
             st.info(f"Periodo seleccionado: del {start_date.strftime('%Y-%m-%d')} al {end_date.strftime('%Y-%m-%d')}")
 
         st.subheader("2. Genera el Reporte")
+        por_ejecutivo = st.checkbox("Un reporte por ejecutivo (con reporte índice, descarga en ZIP)", False)
         if st.button("Generar Reporte por Periodo"):
-            df_periodo = df_master[
-                (df_master['created_at'].dt.date >= start_date) &
-                (df_master['created_at'].dt.date <= end_date)
-            ]
+            df_periodo = df_master.iloc[indice.filtrar(start_date, end_date)]
             filename = f"reports/Reporte_Kommo_{start_date}_a_{end_date}.pdf"
             title = f"Análisis del Periodo {start_date} a {end_date}"
             
             if not os.path.exists('reports'):
                 os.makedirs('reports')
 
-            with st.spinner("Generando reporte PDF..."):
-                st.session_state.generated_file_reports = reporter.generar_reporte_por_fechas(df_periodo, filename, title)
+            if por_ejecutivo:
+                with st.spinner("Generando reportes por ejecutivo..."):
+                    archivos = reporter.generar_reportes_por_ejecutivo(
+                        df_periodo, 'reports', f"Reporte_Kommo_{start_date}_a_{end_date}", title, cubo=cubo.filtrar(start_date, end_date))
+                    if archivos:
+                        zip_path = f"reports/Reportes_Ejecutivos_{start_date}_a_{end_date}.zip"
+                        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                            for archivo in archivos:
+                                zf.write(archivo, os.path.basename(archivo))
+                        st.session_state.generated_file_reports = zip_path
+            else:
+                with st.spinner("Generando reporte PDF..."):
+                    st.session_state.generated_file_reports = reporter.generar_reporte_por_fechas(df_periodo, filename, title, cubo=cubo.filtrar(start_date, end_date))
 
     elif opcion == 'Reporte Histórico Completo':
         st.subheader("Genera el Reporte Histórico Completo")
@@ -120,7 +137,7 @@ if df_master is not None and not df_master.empty:
                 filename = "reports/Reporte_Historico_Kommo.pdf"
                 if not os.path.exists('reports'):
                     os.makedirs('reports')
-                st.session_state.generated_file_reports = reporter.generar_reporte_por_fechas(df_master, filename, "Análisis Histórico General")
+                st.session_state.generated_file_reports = reporter.generar_reporte_por_fechas(df_master, filename, "Análisis Histórico General", cubo=cubo)
 
     elif opcion == 'Comparar Periodos':
         st.subheader("1. Define los Periodos a Comparar")
@@ -143,8 +160,8 @@ if df_master is not None and not df_master.empty:
         
         st.subheader("2. Genera el Reporte Comparativo")
         if st.button("Generar Reporte Comparativo"):
-            df_a = df_master[(df_master['created_at'].dt.date >= start_a) & (df_master['created_at'].dt.date <= end_a)]
-            df_b = df_master[(df_master['created_at'].dt.date >= start_b) & (df_master['created_at'].dt.date <= end_b)]
+            df_a = df_master.iloc[indice.filtrar(start_a, end_a)]
+            df_b = df_master.iloc[indice.filtrar(start_b, end_b)]
             filename = f"reports/Reporte_Comparativo_{start_a.strftime('%Y-%m-%d')}_vs_{start_b.strftime('%Y-%m-%d')}.pdf"
             if not os.path.exists('reports'):
                 os.makedirs('reports')
@@ -165,6 +182,9 @@ if df_master is not None and not df_master.empty:
                 file_name=os.path.basename(st.session_state.generated_file_reports),
                 mime="application/octet-stream"
             )
+        cache = viz.estadisticas_cache()
+        st.caption(f"Caché de gráficos: {cache['aciertos']} aciertos, {cache['fallos']} fallos "
+                   f"({cache['tasa_aciertos']:.0%}) · {cache['entradas']} gráficos, {cache['bytes'] / 1024 / 1024:.1f} MB")
 
         with st.form(key='email_form_reports'):
             st.write("**Enviar por Correo Electrónico**")
@@ -14,6 +14,8 @@ import pandas as pd
 import pytz # Importar pytz
 from config import CONFIG
 import visualizations as viz
+from lead_rollup import CuboLeads
+from lead_tags import obtener_indice_tags
 
 def enviar_correo (asunto, cuerpo, archivo_adjunto):
     try:
@@ -108,24 +110,27 @@ class PDF(FPDF):
         for row in kpi_rows:
             self._draw_kpi_row(row)
 
-    def add_image_section(self, title, image_path):
-        if not os.path.exists(image_path):
+    def add_image_section(self, title, image):
+        """Inserta un gráfico. 'image' es el PNG en memoria que devuelven las funciones de visualizations (None si no se generó)."""
+        if image is None:
             self.check_page_break(30)
             self._chapter_title(title)
             self.cell(0, 10, '(Gráfico no generado por falta de datos)', 0, 1, 'C')
             self.ln(5)
             return
 
-        with Image.open(image_path) as img:
+        image.seek(0)
+        with Image.open(image) as img:
             img_w, img_h = img.size
-            aspect_ratio = img_h / img_w
-            pdf_image_w = self.w - 20
-            pdf_image_h = pdf_image_w * aspect_ratio
-            required_height = 15 + pdf_image_h
-            self.check_page_break(required_height)
-            self._chapter_title(title)
-            self.image(image_path, x=self.get_x() + 10, w=pdf_image_w)
-            self.ln(pdf_image_h + 5)
+        image.seek(0)
+        aspect_ratio = img_h / img_w
+        pdf_image_w = self.w - 20
+        pdf_image_h = pdf_image_w * aspect_ratio
+        required_height = 15 + pdf_image_h
+        self.check_page_break(required_height)
+        self._chapter_title(title)
+        self.image(image, x=self.get_x() + 10, w=pdf_image_w)
+        self.ln(pdf_image_h + 5)
 
     def add_table_section(self, title, df, col_widths):
         title_h, header_h, row_h = 15, 10, 8
@@ -177,102 +182,187 @@ class PDF(FPDF):
         if self.get_y() + required_height > self.h - self.b_margin:
             self.add_page()
 
+ESTADOS_SALUD = ['Saludable', 'En Riesgo', 'Crítico']
+ANCHOS_RENDIMIENTO = [45, 15, 20, 20, 20, 30, 20]
+
+def nombre_archivo(texto):
+    """Fragmento seguro para nombre de archivo (p. ej. el nombre de un ejecutivo)."""
+    return ''.join(c if c.isalnum() else '_' for c in str(texto)).strip('_') or 'sin_nombre'
+
+def _frecuencia(df_periodo):
+    """Granularidad del gráfico de evolución según la duración del periodo."""
+    delta_dias = (df_periodo['created_at'].max() - df_periodo['created_at'].min()).days if not df_periodo.empty else 0
+    return 'D' if delta_dias <= 15 else 'W' if delta_dias <= 90 else 'M'
+
+def _tabla_rendimiento(kpis_por_ejecutivo):
+    """Tabla de rendimiento a partir de CuboLeads.kpis_por('responsable_nombre')."""
+    return pd.DataFrame([
+        [ejecutivo, k['total_leads'], k['ventas_ganadas'], k['perdidos'], k['en_tramite'],
+         f"${k['valor_ganado']:,.0f}", f"{k['tasa_conversion']:.1f}%"]
+        for ejecutivo, k in sorted(kpis_por_ejecutivo.items(), key=lambda item: str(item[0]))
+    ], columns=['Ejecutivo', 'Total', 'Ganados', 'Perdidos', 'Trámite', 'Valor Ganado', 'Conversión'])
+
+def _filas_kpis(kpis):
+    return [
+        [("Leads Generados", kpis['total_leads']), ("Ventas Ganadas", kpis['ventas_ganadas']), ("Tasa Conversión", f"{kpis['tasa_conversion']:.2f}%")],
+        [("Valor Total Ganado", f"${kpis['valor_ganado']:,.2f}"), ("Leads Perdidos", kpis['perdidos']), ("En Trámite", kpis['en_tramite'])],
+    ]
+
+def _agregados_por_ejecutivo(df_periodo, freq, indice_tags):
+    """
+    Conteos de los gráficos de un reporte para todos los ejecutivos a la vez: una
+    agrupación por gráfico, con el ejecutivo como primer nivel del índice. El
+    reporte de cada ejecutivo toma su parte con _de_ejecutivo.
+    """
+    resp = 'responsable_nombre'
+    fechas = df_periodo['created_at_local'] if 'created_at_local' in df_periodo else df_periodo['created_at']
+    creados = pd.DataFrame({resp: df_periodo[resp], 'fecha': fechas})
+    perdidos = df_periodo[df_periodo['estado'] == 'Perdido']
+    en_tramite = df_periodo[df_periodo['salud_lead'] != 'N/A']
+    return {
+        'evolucion': creados.groupby([resp, pd.Grouper(key='fecha', freq=freq)], observed=True).size(),
+        'etapas': df_periodo.groupby([resp, 'etapa_nombre'], observed=True).size(),
+        'salud': en_tramite.groupby([resp, 'salud_lead'], observed=True).size(),
+        'perdida': perdidos.groupby([resp, 'motivo_perdida_nombre'], observed=True).size(),
+        'tags': indice_tags.conteos_por(df_periodo['id'], df_periodo[resp]),
+    }
+
+def _de_ejecutivo(conteos, ejecutivo):
+    """Parte de un agregado de _agregados_por_ejecutivo que corresponde a un ejecutivo (sin ceros)."""
+    try:
+        parte = conteos.xs(ejecutivo, level=0)
+    except KeyError:
+        return pd.Series(dtype='int64')
+    return parte[parte > 0]
+
 class ReportGenerator:
+    """Los periodos que recibe deben ser subconjuntos de 'df_master' (se usa su índice de etiquetas)."""
     def __init__(self, df_master):
         self.df = df_master
 
-    def generar_reporte_por_fechas(self, df_periodo, filename, title_prefix):
+    def _escribir_reporte(self, filename, titulo, kpis, tablas=(), secciones=(), imagenes=()):
+        """
+        Arma y guarda un PDF: KPIs, tablas [(título, df, anchos)] y los gráficos ya
+        dibujados de cada sección [(título, mostrar aunque no haya gráfico, función, args)].
+        """
+        pdf = PDF('P', 'mm', 'A4')
+        pdf.add_page()
+        pdf.add_kpi_section(titulo, _filas_kpis(kpis))
+        for titulo_tabla, tabla, anchos in tablas:
+            if not tabla.empty:
+                pdf.add_table_section(titulo_tabla, tabla, col_widths=anchos)
+        for (titulo_seccion, siempre, _, _), imagen in zip(secciones, imagenes):
+            if imagen is not None or siempre:
+                pdf.add_image_section(titulo_seccion, imagen)
+        pdf.output(filename)
+
+    def generar_reporte_por_fechas(self, df_periodo, filename, title_prefix, cubo=None):
+        """
+        Genera el PDF de un periodo. Si se pasa 'cubo' (el CuboLeads ya filtrado al
+        mismo periodo), los KPIs salen de él en lugar de recorrer los leads.
+        """
         if df_periodo.empty:
             st.warning(f"No se encontraron datos para el reporte '{title_prefix}'.")
             return None
 
-        pdf = PDF('P', 'mm', 'A4')
-        pdf.add_page()
+        cubo = cubo if cubo is not None else CuboLeads.desde_leads(df_periodo)
+        rendimiento = _tabla_rendimiento(cubo.kpis_por('responsable_nombre'))
+        freq = _frecuencia(df_periodo)
 
-        total_leads = len(df_periodo)
-        ventas_concluidas_df = df_periodo[df_periodo['estado'] == 'Ganado']
-        total_ventas_concluidas = len(ventas_concluidas_df)
-        tasa_conversion = (total_ventas_concluidas / total_leads * 100) if total_leads > 0 else 0
-        valor_total_concluido = ventas_concluidas_df['price'].sum()
+        # Los datos de cada gráfico se agregan aquí y el dibujo se reparte entre procesos.
+        # Cada sección: (título, mostrar aunque no haya gráfico, función, args)
+        secciones = [
+            ("Creación de Leads en el Periodo", False, viz.graficar_evolucion, (viz.serie_evolucion(df_periodo, freq), freq, 'Creación de Leads')),
+        ]
 
-        kpi_row1 = [("Leads Generados", total_leads), ("Ventas Ganadas", total_ventas_concluidas), ("Tasa Conversión", f"{tasa_conversion:.2f}%")]
-        kpi_row2 = [("Valor Total Ganado", f"${valor_total_concluido:,.2f}"), ("Leads Perdidos", len(df_periodo[df_periodo['estado'] == 'Perdido'])), ("En Trámite", len(df_periodo[df_periodo['estado'] == 'En Trámite']))]
-        
-        pdf.add_kpi_section(title_prefix, [kpi_row1, kpi_row2])
+        resp_data = df_periodo['responsable_nombre'].value_counts().loc[lambda s: s > 0].sort_values()
+        secciones.append(("Distribución de Leads por Responsable", True, viz.crear_grafico_barras_h, (resp_data, 'Distribución de Leads por Responsable', 'Cantidad de Leads', 'Ejecutivo')))
 
-        files_to_clean = []
-        if not df_periodo.empty:
-            rendimiento = df_periodo.groupby('responsable_nombre').agg(
-                Total=('id', 'count'),
-                Ganados=('estado', lambda x: (x == 'Ganado').sum()),
-                Perdidos=('estado', lambda x: (x == 'Perdido').sum()),
-                En_Tramite=('estado', lambda x: (x == 'En Trámite').sum()),
-                Valor_Ganado=('price', lambda x: df_periodo.loc[x.index][df_periodo.loc[x.index, 'estado'] == 'Ganado']['price'].sum())
-            ).reset_index()
+        etapa_data = df_periodo['etapa_nombre'].value_counts().loc[lambda s: s > 0].sort_values()
+        secciones.append(("Distribución de Leads por Etapa Actual", True, viz.crear_grafico_barras_h, (etapa_data, 'Distribución de Leads por Etapa Actual', 'Cantidad de Leads', 'Etapa')))
 
-            if not rendimiento.empty:
-                rendimiento['Conversión'] = (rendimiento['Ganados'] / rendimiento['Total'] * 100).apply(lambda x: f"{x:.1f}%")
-                rendimiento['Valor_Ganado'] = rendimiento['Valor_Ganado'].apply(lambda x: f"${x:,.0f}")
-                
-                columnas_a_seleccionar = ['responsable_nombre', 'Total', 'Ganados', 'Perdidos', 'En_Tramite', 'Valor_Ganado', 'Conversión']
-                rendimiento_final = rendimiento[columnas_a_seleccionar]
-                rendimiento_final.columns = ['Ejecutivo', 'Total', 'Ganados', 'Perdidos', 'Trámite', 'Valor Ganado', 'Conversión']
-                pdf.add_table_section("Tabla de Rendimiento por Ejecutivo", rendimiento_final, col_widths=[45, 15, 20, 20, 20, 30, 20])
-
-            delta_dias = (df_periodo['created_at'].max() - df_periodo['created_at'].min()).days if not df_periodo.empty else 0
-            freq = 'D' if delta_dias <= 15 else 'W' if delta_dias <= 90 else 'M'
-            
-            img_evolucion = "evolucion_periodo.png"
-            viz.crear_grafico_evolucion(df_periodo, img_evolucion, freq=freq, title='Creación de Leads')
-            files_to_clean.append(img_evolucion)
-            if os.path.exists(img_evolucion):
-                pdf.add_image_section("Creación de Leads en el Periodo", img_evolucion)
-
-            resp_data = df_periodo['responsable_nombre'].value_counts().sort_values()
-            img_resp = "responsables_periodo.png"
-            viz.crear_grafico_barras_h(resp_data, 'Distribución de Leads por Responsable', 'Cantidad de Leads', 'Ejecutivo', img_resp)
-            files_to_clean.append(img_resp)
-            pdf.add_image_section("Distribución de Leads por Responsable", img_resp)
-
-            etapa_data = df_periodo['etapa_nombre'].value_counts().sort_values()
-            img_etapas = "etapas_periodo.png"
-            viz.crear_grafico_barras_h(etapa_data, 'Distribución de Leads por Etapa Actual', 'Cantidad de Leads', 'Etapa', img_etapas)
-            files_to_clean.append(img_etapas)
-            pdf.add_image_section("Distribución de Leads por Etapa Actual", img_etapas)
-
-            img_salud = "salud_periodo.png"
-            viz.crear_grafico_salud_leads(df_periodo, img_salud)
-            files_to_clean.append(img_salud)
-            if os.path.exists(img_salud):
-                pdf.add_image_section("Salud de Leads en Trámite", img_salud)
-
-            img_funnel = "funnel_periodo.png"
-            viz.crear_funnel_ejecutivo(df_periodo, img_funnel)
-            files_to_clean.append(img_funnel)
-            if os.path.exists(img_funnel):
-                pdf.add_image_section("Funnel de Conversión por Ejecutivo", img_funnel)
-
-            tags_series = df_periodo.explode('tags')['tags'].dropna()
-            if not tags_series.empty:
-                top_tags = tags_series.value_counts().nlargest(10).sort_values()
-                img_tags = "tags_periodo.png"
-                viz.crear_grafico_barras_h(top_tags, 'Servicios Más Solicitados (Top 10 Tags)', 'Cantidad de Leads', 'Servicio/Tag', img_tags)
-                files_to_clean.append(img_tags)
-                pdf.add_image_section("Servicios Más Solicitados (Basado en Etiquetas)", img_tags)
-
-            loss_data = df_periodo[df_periodo['estado'] == 'Perdido']['motivo_perdida_nombre'].value_counts()
-            if not loss_data.empty:
-                img_perdida = "perdida_periodo.png"
-                viz.crear_grafico_dona(loss_data, 'Principales Motivos de Pérdida', img_perdida)
-                files_to_clean.append(img_perdida)
-                pdf.add_image_section("Análisis de Motivos de Pérdida", img_perdida)
+        secciones.append(("Salud de Leads en Trámite", False, viz.graficar_salud, (viz.datos_salud(df_periodo),)))
+        secciones.append(("Funnel de Conversión por Ejecutivo", False, viz.graficar_funnel, (viz.datos_funnel(df_periodo),)))
 
-        pdf.output(filename)
+        tags_periodo = obtener_indice_tags(self.df).conteos(df_periodo['id'])
+        if not tags_periodo.empty:
+            top_tags = tags_periodo.nlargest(10).sort_values()
+            secciones.append(("Servicios Más Solicitados (Basado en Etiquetas)", True, viz.crear_grafico_barras_h, (top_tags, 'Servicios Más Solicitados (Top 10 Tags)', 'Cantidad de Leads', 'Servicio/Tag')))
+
+        loss_data = df_periodo[df_periodo['estado'] == 'Perdido']['motivo_perdida_nombre'].value_counts().loc[lambda s: s > 0]
+        if not loss_data.empty:
+            secciones.append(("Análisis de Motivos de Pérdida", True, viz.crear_grafico_dona, (loss_data, 'Principales Motivos de Pérdida')))
+
+        imagenes = viz.renderizar_graficos([(funcion, args, {}) for _, _, funcion, args in secciones])
+        self._escribir_reporte(filename, title_prefix, cubo.kpis(),
+                               tablas=[("Tabla de Rendimiento por Ejecutivo", rendimiento, ANCHOS_RENDIMIENTO)],
+                               secciones=secciones, imagenes=imagenes)
         st.success(f"Reporte guardado como '{filename}'")
-        for f in files_to_clean:
-            if os.path.exists(f): os.remove(f)
         return filename
 
+    def generar_reportes_por_ejecutivo(self, df_periodo, carpeta, nombre_base, title_prefix, cubo=None):
+        """
+        Un PDF por ejecutivo más un reporte índice con la tabla de rendimiento y el
+        archivo de cada uno. KPIs y gráficos de todos los ejecutivos salen de una sola
+        agrupación del periodo (ver _agregados_por_ejecutivo) y todos los gráficos se
+        dibujan en un solo lote. Devuelve la lista de archivos (el índice primero).
+        """
+        if df_periodo.empty:
+            st.warning(f"No se encontraron datos para el reporte '{title_prefix}'.")
+            return []
+
+        cubo = cubo if cubo is not None else CuboLeads.desde_leads(df_periodo)
+        kpis_por_ejecutivo = cubo.kpis_por('responsable_nombre')
+        freq = _frecuencia(df_periodo)
+        agregados = _agregados_por_ejecutivo(df_periodo, freq, obtener_indice_tags(self.df))
+
+        secciones_por_ejecutivo = {}
+        for ejecutivo in sorted(kpis_por_ejecutivo, key=str):
+            evolucion = _de_ejecutivo(agregados['evolucion'], ejecutivo)
+            if not evolucion.empty:
+                evolucion = evolucion.asfreq(freq, fill_value=0)
+            salud = _de_ejecutivo(agregados['salud'], ejecutivo)
+            if not salud.empty:
+                salud = salud.reindex(ESTADOS_SALUD, fill_value=0)
+            secciones = [
+                ("Creación de Leads en el Periodo", False, viz.graficar_evolucion, (evolucion, freq, 'Creación de Leads')),
+                ("Distribución de Leads por Etapa Actual", True, viz.crear_grafico_barras_h,
+                 (_de_ejecutivo(agregados['etapas'], ejecutivo).sort_values(), 'Distribución de Leads por Etapa Actual', 'Cantidad de Leads', 'Etapa')),
+                ("Salud de Leads en Trámite", False, viz.graficar_salud, (salud,)),
+            ]
+            top_tags = _de_ejecutivo(agregados['tags'], ejecutivo)
+            if not top_tags.empty:
+                secciones.append(("Servicios Más Solicitados (Basado en Etiquetas)", True, viz.crear_grafico_barras_h,
+                                  (top_tags.nlargest(10).sort_values(), 'Servicios Más Solicitados (Top 10 Tags)', 'Cantidad de Leads', 'Servicio/Tag')))
+            loss_data = _de_ejecutivo(agregados['perdida'], ejecutivo)
+            if not loss_data.empty:
+                secciones.append(("Análisis de Motivos de Pérdida", True, viz.crear_grafico_dona,
+                                  (loss_data.sort_values(ascending=False), 'Principales Motivos de Pérdida')))
+            secciones_por_ejecutivo[ejecutivo] = secciones
+
+        # Los gráficos de todos los ejecutivos se dibujan en un solo lote
+        todas = [seccion for secciones in secciones_por_ejecutivo.values() for seccion in secciones]
+        imagenes = viz.renderizar_graficos([(funcion, args, {}) for _, _, funcion, args in todas])
+
+        archivos = {}
+        inicio = 0
+        for ejecutivo, secciones in secciones_por_ejecutivo.items():
+            archivo = os.path.join(carpeta, f"{nombre_base}_{nombre_archivo(ejecutivo)}.pdf")
+            self._escribir_reporte(archivo, f"{title_prefix} - {ejecutivo}", kpis_por_ejecutivo[ejecutivo],
+                                   secciones=secciones, imagenes=imagenes[inicio:inicio + len(secciones)])
+            inicio += len(secciones)
+            archivos[ejecutivo] = archivo
+
+        indice = os.path.join(carpeta, f"{nombre_base}_Indice.pdf")
+        listado = pd.DataFrame([[ejecutivo, os.path.basename(archivo)] for ejecutivo, archivo in archivos.items()],
+                               columns=['Ejecutivo', 'Archivo'])
+        self._escribir_reporte(indice, f"{title_prefix} - Índice por Ejecutivo", cubo.kpis(), tablas=[
+            ("Tabla de Rendimiento por Ejecutivo", _tabla_rendimiento(kpis_por_ejecutivo), ANCHOS_RENDIMIENTO),
+            ("Reportes Individuales", listado, [50, 120]),
+        ])
+        st.success(f"Se generaron {len(archivos)} reportes por ejecutivo y el índice '{indice}'")
+        return [indice] + list(archivos.values())
+
     def generar_reporte_comparativo(self, df_a, df_b, period_a_str, period_b_str, filename):
         pdf = PDF('P', 'mm', 'A4')
         pdf.add_page()
@@ -310,15 +400,12 @@ class ReportGenerator:
 
         pdf.add_comparison_kpi_table(f"Comparativo: {period_a_str} vs {period_b_str}", comparison_data)
 
-        files_to_clean = []
-        img_comp_evol = "comparativo_evolucion.png"
-        viz.crear_grafico_evolucion_comparativo(df_a, df_b, img_comp_evol)
-        files_to_clean.append(img_comp_evol)
-        if os.path.exists(img_comp_evol):
+        img_comp_evol = viz.crear_grafico_evolucion_comparativo(df_a, df_b)
+        if img_comp_evol is not None:
             pdf.add_image_section("Creación de Leads: Comparativo de Periodos", img_comp_evol)
 
         if not df_a.empty:
-            rendimiento = df_a.groupby('responsable_nombre').agg(
+            rendimiento = df_a.groupby('responsable_nombre', observed=True).agg(
                 Total=('id', 'count'),
                 Ganados=('estado', lambda x: (x == 'Ganado').sum()),
                 Proceso_Cobro=('estado', lambda x: (x == 'Proceso de Cobro').sum()),
@@ -332,14 +419,10 @@ class ReportGenerator:
                 rendimiento_final.columns = ['Ejecutivo', 'Total', 'Concluidas', 'Valor Concluido', 'Tasa Conv.']
                 pdf.add_table_section(f"Rendimiento por Ejecutivo (Periodo Actual)", rendimiento_final, col_widths=[85, 25, 25, 30, 25])
 
-            img_funnel = "funnel_comparativo.png"
-            viz.crear_funnel_ejecutivo(df_a, img_funnel)
-            files_to_clean.append(img_funnel)
-            if os.path.exists(img_funnel):
+            img_funnel = viz.crear_funnel_ejecutivo(df_a)
+            if img_funnel is not None:
                 pdf.add_image_section("Funnel de Conversión (Periodo Actual)", img_funnel)
 
         pdf.output(filename)
         st.success(f"Reporte comparativo guardado como '{filename}'")
-        for f in files_to_clean:
-            if os.path.exists(f): os.remove(f)
         return filename
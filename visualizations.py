@@ -1,5 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import io
+import os
+import atexit
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from matplotlib.ticker import FuncFormatter
@@ -19,27 +29,146 @@ except:
     except:
         pass  # Usar configuración por defecto del sistema
 
-def crear_grafico_evolucion(df, filename, freq='M', title='Evolución de Nuevos Leads'):
+def _a_png(fig, **savefig_kwargs):
+    """Renderiza la figura a un PNG en memoria y la cierra. Devuelve el buffer listo para leer."""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', **savefig_kwargs)
+    plt.close(fig)
+    buffer.seek(0)
+    return buffer
+
+# --- Caché de gráficos ---
+# Cada PNG se guarda bajo una huella de los datos agregados que dibuja (no del
+# DataFrame completo), así que volver a generar un reporte o un rerun del dashboard
+# con los mismos datos reutiliza la imagen en lugar de volver a dibujarla.
+
+class CacheGraficos:
+    """Caché LRU de PNG en memoria con tope de tamaño total en bytes."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entradas = OrderedDict()
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave):
+        with self.lock:
+            png = self.entradas.get(clave)
+            if png is None:
+                self.fallos += 1
+                return None
+            self.entradas.move_to_end(clave)
+            self.aciertos += 1
+            return png
+
+    def guardar(self, clave, png):
+        if len(png) > self.max_bytes:
+            return
+        with self.lock:
+            anterior = self.entradas.pop(clave, None)
+            if anterior is not None:
+                self.bytes -= len(anterior)
+            self.entradas[clave] = png
+            self.bytes += len(png)
+            while self.bytes > self.max_bytes:
+                _, descartado = self.entradas.popitem(last=False)
+                self.bytes -= len(descartado)
+
+    def estadisticas(self):
+        with self.lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0.0,
+                'entradas': len(self.entradas),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+_cache = CacheGraficos(CONFIG['reportes']['cache_graficos_mb'] * 1024 * 1024)
+
+def estadisticas_cache():
+    """Aciertos, fallos y ocupación de la caché de gráficos de este proceso."""
+    return _cache.estadisticas()
+
+def _actualizar_huella(h, valor):
+    if isinstance(valor, (pd.Series, pd.DataFrame)):
+        # Valores e índice, más lo que hash_pandas_object no incluye (nombres, tipos, zona horaria)
+        h.update(pd.util.hash_pandas_object(valor, index=True).to_numpy().tobytes())
+        etiquetas = valor.columns if isinstance(valor, pd.DataFrame) else [valor.name]
+        h.update(repr((type(valor).__name__, list(etiquetas), str(valor.index.dtype), list(valor.index.names))).encode())
+    else:
+        h.update(repr(valor).encode())
+    h.update(b'\x00')
+
+def _clave_grafico(funcion, args, kwargs):
+    h = hashlib.blake2b(digest_size=16)
+    _actualizar_huella(h, funcion.__qualname__)
+    for valor in args:
+        _actualizar_huella(h, valor)
+    for nombre in sorted(kwargs):
+        _actualizar_huella(h, nombre)
+        _actualizar_huella(h, kwargs[nombre])
+    return h.digest()
+
+def _con_cache(funcion):
+    """Sirve el gráfico desde la caché si ya se dibujó con los mismos datos agregados."""
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        clave = _clave_grafico(funcion, args, kwargs)
+        png = _cache.obtener(clave)
+        if png is not None:
+            return io.BytesIO(png)
+        buffer = funcion(*args, **kwargs)
+        if buffer is not None:
+            _cache.guardar(clave, buffer.getvalue())
+        return buffer
+    return envoltura
+
+# --- Preparación de datos ---
+# Cada gráfico se separa en la agregación (sobre los leads) y el dibujo (sobre los
+# datos ya agregados), para poder dibujar en otros procesos enviando solo los agregados.
+
+def serie_evolucion(df, freq='M'):
+    """Leads creados por periodo, en la zona horaria local."""
     if df.empty:
-        return
+        return pd.Series(dtype='int64')
+    fechas = df['created_at_local'] if 'created_at_local' in df else df['created_at']
+    return pd.Series(1, index=pd.DatetimeIndex(fechas)).resample(freq).size()
+
+def datos_funnel(df):
+    """Porcentaje de leads por estado para cada ejecutivo."""
+    funnel_data = df.groupby(['responsable_nombre', 'estado'], observed=True).size().unstack(fill_value=0)
+    if funnel_data.empty:
+        return funnel_data
+    order = ['Ganado', 'En Trámite', 'Perdido']
+    for col in order:
+        if col not in funnel_data.columns:
+            funnel_data[col] = 0
+    funnel_data = funnel_data[order]
+    return funnel_data.div(funnel_data.sum(axis=1), axis=0) * 100
+
+def datos_salud(df):
+    """Conteo de leads en trámite por estado de salud."""
+    health_counts = df[df['salud_lead'] != 'N/A']['salud_lead'].value_counts()
+    if health_counts.empty or health_counts.sum() == 0:
+        return pd.Series(dtype='int64')
+    return health_counts.reindex(['Saludable', 'En Riesgo', 'Crítico'], fill_value=0)
+
+# --- Gráficos ---
+
+def crear_grafico_evolucion(df, freq='M', title='Evolución de Nuevos Leads'):
+    return graficar_evolucion(serie_evolucion(df, freq), freq, title)
+
+@_con_cache
+def graficar_evolucion(data, freq='M', title='Evolución de Nuevos Leads'):
+    if data.empty:
+        return None
         
     fig, ax = plt.subplots(figsize=(12, 6))
     
-    # Preparar los datos asegurando el timezone correcto
-    df_copy = df.copy()
-    
-    # Convertir created_at a timezone local para el procesamiento
-    if df_copy['created_at'].dt.tz is not None:
-        # Si tiene timezone, convertir a local
-        df_copy['created_at'] = df_copy['created_at'].dt.tz_convert('America/Mexico_City')
-    
-    # Crear la serie de datos agrupados por fecha
-    data = df_copy.set_index('created_at').resample(freq).size()
-    
-    if data.empty:
-        plt.close()
-        return
-    
     freq_map = {'D': 'Diario', 'W': 'Semanal', 'M': 'Mensual'}
     full_title = f"{title} ({freq_map.get(freq, '')})"
     
@@ -103,17 +232,20 @@ def crear_grafico_evolucion(df, filename, freq='M', title='Evolución de Nuevos
     
     # Ajustar el layout
     fig.tight_layout()
-    fig.savefig(filename, dpi=300, bbox_inches='tight')
-    plt.close()
+    return _a_png(fig, dpi=300, bbox_inches='tight')
 
-def crear_grafico_evolucion_comparativo(df_a, df_b, filename):
+def crear_grafico_evolucion_comparativo(df_a, df_b):
+    return graficar_evolucion_comparativo(
+        df_a.set_index('created_at').resample('D').size() if not df_a.empty else pd.Series(dtype='int64'),
+        df_b.set_index('created_at').resample('D').size() if not df_b.empty else pd.Series(dtype='int64'))
+
+@_con_cache
+def graficar_evolucion_comparativo(data_a, data_b):
     fig, ax = plt.subplots(figsize=(12, 6))
-    if not df_a.empty:
-        data_a = df_a.set_index('created_at').resample('D').size()
+    if not data_a.empty:
         dias_a = (data_a.index - data_a.index[0]).days
         ax.plot(dias_a, data_a.values, marker='o', linestyle='-', label='Periodo Actual', color=CONFIG['colores']['principal'])
-    if not df_b.empty:
-        data_b = df_b.set_index('created_at').resample('D').size()
+    if not data_b.empty:
         dias_b = (data_b.index - data_b.index[0]).days
         ax.plot(dias_b, data_b.values, marker='o', linestyle='--', label='Periodo Anterior', color=CONFIG['colores']['texto'])
     ax.set_title("Creación de Leads: Comparativo de Periodos", fontsize=16, color=CONFIG['colores']['texto'])
@@ -122,11 +254,11 @@ def crear_grafico_evolucion_comparativo(df_a, df_b, filename):
     ax.legend()
     ax.grid(True)
     fig.tight_layout()
-    fig.savefig(filename)
-    plt.close()
+    return _a_png(fig)
 
-def crear_grafico_barras_h(data, title, xlabel, ylabel, filename, color_key='principal'):
-    plt.figure(figsize=(10, 8))
+@_con_cache
+def crear_grafico_barras_h(data, title, xlabel, ylabel, color_key='principal'):
+    fig = plt.figure(figsize=(10, 8))
     sns.barplot(x=data.values, y=data.index, orient='h', color=CONFIG['colores'][color_key])
     plt.title(title, fontsize=16, color=CONFIG['colores']['texto'])
     plt.xlabel(xlabel)
@@ -134,13 +266,13 @@ def crear_grafico_barras_h(data, title, xlabel, ylabel, filename, color_key='pri
     for index, value in enumerate(data):
         plt.text(value, index, f' {value}', va='center', fontweight='bold')
     plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
+    return _a_png(fig)
 
-def crear_grafico_dona(data, title, filename):
-    if data.empty: return
+@_con_cache
+def crear_grafico_dona(data, title):
+    if data.empty: return None
     # Aumentar el tamaño de la figura para dar espacio a la leyenda
-    plt.figure(figsize=(12, 8))
+    fig = plt.figure(figsize=(12, 8))
 
     # --- CORRECCIÓN PARA EVITAR TEXTO ENCIMADO ---
     # 1. Calcular porcentajes para usarlos en la leyenda
@@ -173,21 +305,15 @@ def crear_grafico_dona(data, title, filename):
         bbox_to_anchor=(1, 0, 0.5, 1) # Posiciona la leyenda a la derecha del gráfico
     )
     
-    plt.savefig(filename, bbox_inches='tight', pad_inches=0.1)
-    plt.close()
+    return _a_png(fig, bbox_inches='tight', pad_inches=0.1)
 
 
-def crear_funnel_ejecutivo(df, filename):
-    funnel_data = df.groupby(['responsable_nombre', 'estado']).size().unstack(fill_value=0)
-    if funnel_data.empty: return
+def crear_funnel_ejecutivo(df):
+    return graficar_funnel(datos_funnel(df))
 
-    order = ['Ganado', 'En Trámite', 'Perdido']
-    
-    for col in order:
-        if col not in funnel_data.columns:
-            funnel_data[col] = 0
-            
-    funnel_data = funnel_data[order]
+@_con_cache
+def graficar_funnel(funnel_perc):
+    if funnel_perc.empty: return None
 
     funnel_colors = [
         CONFIG['colores'].get('ganado', '#28a745'),
@@ -195,32 +321,29 @@ def crear_funnel_ejecutivo(df, filename):
         CONFIG['colores'].get('perdido', '#dc3545')
     ]
 
-    funnel_perc = funnel_data.div(funnel_data.sum(axis=1), axis=0) * 100
-
-    funnel_perc.plot(kind='barh', stacked=True, color=funnel_colors, figsize=(12, 8), width=0.8)
+    ax = funnel_perc.plot(kind='barh', stacked=True, color=funnel_colors, figsize=(12, 8), width=0.8)
     
     plt.title('Funnel de Conversión por Ejecutivo', fontsize=16, color=CONFIG['colores']['texto'])
     plt.xlabel('Porcentaje de Leads (%)')
     plt.ylabel('Ejecutivo')
     plt.legend(title='Estado', bbox_to_anchor=(1.05, 1), loc='upper left')
     plt.gca().xaxis.set_major_formatter(FuncFormatter('{:.0f}%'.format))
-    plt.savefig(filename, bbox_inches='tight')
-    plt.close()
+    return _a_png(ax.figure, bbox_inches='tight')
 
-def crear_grafico_salud_leads(df, filename):
-    health_counts = df[df['salud_lead'] != 'N/A']['salud_lead'].value_counts()
-    if health_counts.empty: return
+def crear_grafico_salud_leads(df):
+    return graficar_salud(datos_salud(df))
+
+@_con_cache
+def graficar_salud(health_counts):
+    if health_counts.empty: return None
 
-    health_order = ['Saludable', 'En Riesgo', 'Crítico']
-    health_counts = health_counts.reindex(health_order, fill_value=0)
-    
     colors = [
         CONFIG['colores'].get('ganado', '#28a745'),
         CONFIG['colores'].get('en_tramite', '#ffc107'),
         CONFIG['colores'].get('perdido', '#dc3545')
     ]
     
-    plt.figure(figsize=(10, 6))
+    fig = plt.figure(figsize=(10, 6))
     sns.barplot(x=health_counts.index, y=health_counts.values, palette=colors)
     plt.title('Puntuación de Salud de Leads en Trámite', fontsize=16, color=CONFIG['colores']['texto'])
     plt.ylabel('Cantidad de Leads')
@@ -228,5 +351,93 @@ def crear_grafico_salud_leads(df, filename):
     for index, value in enumerate(health_counts):
         plt.text(index, value, f' {value}', ha='center', va='bottom', fontweight='bold')
     plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
+    return _a_png(fig)
+
+# --- Renderizado en paralelo ---
+# pyplot guarda estado global y no es seguro entre hilos, así que los gráficos de un
+# reporte se dibujan en procesos separados a partir de los datos ya agregados.
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_preparado = False
+
+def _procesos_graficos():
+    configurados = CONFIG['reportes']['procesos_graficos']
+    return configurados or os.cpu_count() or 1
+
+def _obtener_pool():
+    """Pool de procesos compartido (se crea una vez; arrancar procesos cuesta más que un gráfico)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=_procesos_graficos(), mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _descartar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+# Sin esto los procesos del pool quedarían vivos hasta que el intérprete los recoja al salir
+atexit.register(_descartar_pool)
+
+def _usar_pool(n_tareas):
+    return CONFIG['reportes']['graficos_en_paralelo'] and n_tareas > 1 and _procesos_graficos() > 1
+
+def _listo():
+    return True
+
+def preparar_procesos():
+    """
+    Arranca el pool en segundo plano (sin esperar) para que los procesos ya hayan
+    importado matplotlib cuando se pida el primer reporte. Solo actúa la primera
+    vez en cada proceso: la página de reportes lo llama en cada rerun.
+    """
+    global _pool_preparado
+    with _pool_lock:
+        if _pool_preparado:
+            return
+        _pool_preparado = True
+    if _usar_pool(_procesos_graficos()):
+        pool = _obtener_pool()
+        for _ in range(_procesos_graficos()):
+            pool.submit(_listo)
+
+def _renderizar(funcion, args, kwargs):
+    # En el proceso hijo se dibuja sin caché: la del proceso principal es la que se consulta
+    funcion = getattr(funcion, '__wrapped__', funcion)
+    buffer = funcion(*args, **kwargs)
+    return buffer.getvalue() if buffer is not None else None
+
+def renderizar_graficos(tareas):
+    """
+    Dibuja una lista de gráficos [(funcion, args, kwargs), ...] y devuelve sus PNG en
+    memoria en el mismo orden. Las funciones deben ser de este módulo (se envían por
+    nombre a los procesos) y los argumentos, datos ya agregados.
+    Los gráficos que ya están en caché no se vuelven a dibujar. Con un solo proceso
+    disponible, o si el pool falla, se dibuja aquí mismo.
+    """
+    claves = [_clave_grafico(getattr(funcion, '__wrapped__', funcion), args, kwargs) for funcion, args, kwargs in tareas]
+    pngs = [_cache.obtener(clave) for clave in claves]
+    pendientes = [i for i, png in enumerate(pngs) if png is None]
+
+    if _usar_pool(len(pendientes)):
+        try:
+            pool = _obtener_pool()
+            futures = {i: pool.submit(_renderizar, *tareas[i]) for i in pendientes}
+            for i, future in futures.items():
+                pngs[i] = future.result()
+                if pngs[i] is not None:
+                    _cache.guardar(claves[i], pngs[i])
+            pendientes = []
+        except (BrokenProcessPool, OSError):
+            _descartar_pool()
+    for i in pendientes:
+        funcion, args, kwargs = tareas[i]
+        buffer = _renderizar(funcion, args, kwargs)
+        pngs[i] = buffer
+        if buffer is not None:
+            _cache.guardar(claves[i], buffer)
+    return [io.BytesIO(png) if png is not None else None for png in pngs]